@@ -0,0 +1,258 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Sequence, TYPE_CHECKING
+from numpy.typing import NDArray, ArrayLike
+from Lib.MercatorProjection import MercatorProjection
+from Lib.FrameDecoder import decode_frame
+from Lib.IntegralImage import window_means
+from Lib.Instrumentation import stats
+
+if TYPE_CHECKING:
+    from Lib.SatImgReader import SatImgReader
+
+
+# Gewichte der Umrechnung RGB -> Graustufen wie bei PIL (ITU-R 601-2)
+_GRAY_WEIGHTS: NDArray = np.array([0.299, 0.587, 0.114])
+# Zlib-Stufe der PNGs - schnelles Schreiben ist hier wichtiger als die Dateigröße
+PNG_COMPRESS_LEVEL: int = 1
+JPEG_QUALITY: int = 90
+# Ausgabeformate der Einzelbilder und der Animationen (über Pillow)
+FRAME_SUFFIXES: List[str] = [".png", ".jpg"]
+ANIMATION_SUFFIXES: List[str] = [".gif", ".webp", ".png"]
+
+
+class BatchRenderer:
+    """
+    Zeichnet Satellitenbilder mit markierten Stationen ohne Fenster (Agg), z.B. für die Kontrolle eines ganzen Tages
+
+    Figur, Marker und Titel werden nur einmal angelegt und je Bild nur aktualisiert. Matplotlib zeichnet dabei nur
+    diese Überlagerung auf transparentem Grund, in das Satellitenbild wird sie anschließend mit NumPy an den
+    betroffenen Pixeln eingeblendet - das Bild selbst läuft nicht durch die Bildpipeline von matplotlib. Ein Pixel
+    des Satellitenbildes entspricht einem Pixel der Ausgabe, scale < 1 verkleinert das fertige Bild.
+
+    Mit coverage_radius werden die Marker nach dem Bedeckungsgrad im Fenster um die Station eingefärbt (0 % blau,
+    100 % rot), berechnet mit cloud_threshold wie bei SatImgReader.
+    """
+    def __init__(self,
+                 projection: MercatorProjection,
+                 lats: ArrayLike,
+                 lons: ArrayLike,
+                 coverage_radius: int | None = None,
+                 cloud_threshold: float = 160,
+                 marker_size: float = 50,
+                 scale: float = 1.0,
+                 dpi: int = 100):
+        if not 0 < scale <= 1:
+            raise ValueError(f"The scale of the BatchRenderer must be in (0, 1]: {scale}")
+        # ohne pyplot: kein GUI-Backend, keine globale Figurenverwaltung
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib import colormaps
+        self.projection = projection
+        self.lats: NDArray = np.asarray(lats, dtype="float64").reshape(-1)
+        self.lons: NDArray = np.asarray(lons, dtype="float64").reshape(-1)
+        self.pix_x, self.pix_y = projection.latlon_to_pixel(self.lats, self.lons)
+        self.coverage_radius = coverage_radius
+        self.cloud_threshold = cloud_threshold
+        self.scale = scale
+        width, height = projection.img_width, projection.img_height
+
+        self.figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+        self.figure.patch.set_alpha(0)
+        self.canvas = FigureCanvasAgg(self.figure)
+        axes = self.figure.add_axes((0, 0, 1, 1))
+        axes.set_axis_off()
+        # alle Stationen als eine Punktwolke, die Farben werden je Bild gesetzt
+        self._markers = axes.scatter(self.pix_x, self.pix_y, s=marker_size, marker="o", facecolors="none",
+                                     edgecolors="red", linewidths=1)
+        axes.set_xlim(-0.5, width - 0.5)
+        axes.set_ylim(height - 0.5, -0.5)
+        self._cmap = colormaps["coolwarm"]
+        self._title = self.figure.text(0.01, 0.99, "", ha="left", va="top", color="white", fontsize=9,
+                                       bbox={"facecolor": "black", "alpha": 0.5, "linewidth": 0})
+
+    def coverage(self, img_arr: NDArray) -> NDArray:
+        """
+        Bedeckungsgrad in % an den Stationen, für RGB-Bilder aus den auf uint8 gerundeten Graustufen berechnet
+        """
+        gray = img_arr if img_arr.ndim == 2 else np.rint(img_arr[..., :3] @ _GRAY_WEIGHTS).astype("uint8")
+        gray_means = window_means(gray, self.pix_y, self.pix_x, self.coverage_radius)[:, 0]
+        return np.minimum(gray_means / self.cloud_threshold, 1) * 100
+
+    def update(self, img_arr: NDArray, title: str = ""):
+        """
+        Titel tauschen und ggf. die Marker nach dem Bild (Graustufen oder RGB) neu einfärben
+        """
+        self._title.set_text(title)
+        self._title.set_visible(bool(title))
+        if self.coverage_radius is not None:
+            self._markers.set_edgecolors(self._cmap(self.coverage(img_arr) / 100))
+
+    def render(self, img_arr: NDArray, title: str = "") -> NDArray:
+        """
+        Bild mit Markern und Titel zeichnen, liefert die Ausgabe als RGB-Array (Höhe, Breite, 3)
+        """
+        if img_arr.shape[:2] != (self.projection.img_height, self.projection.img_width):
+            raise ValueError(f"The image has the shape {img_arr.shape}, the BatchRenderer expects "
+                             f"{(self.projection.img_height, self.projection.img_width)}")
+        with stats.timer("render", 1):
+            self.update(img_arr, title)
+            self.canvas.draw()
+            overlay = np.asarray(self.canvas.buffer_rgba())
+            rendered = np.repeat(img_arr[..., None], 3, axis=2) if img_arr.ndim == 2 else img_arr[..., :3].copy()
+            # nur die Pixel der Überlagerung mischen (nicht vormultipliziertes Alpha)
+            rows, cols = np.nonzero(overlay[..., 3])
+            alpha = overlay[rows, cols, 3:] / 255
+            rendered[rows, cols] = np.round(overlay[rows, cols, :3] * alpha + rendered[rows, cols] * (1 - alpha))
+        if self.scale == 1:
+            return rendered
+        from PIL import Image
+        size = (max(round(rendered.shape[1] * self.scale), 1), max(round(rendered.shape[0] * self.scale), 1))
+        return np.asarray(Image.fromarray(rendered).resize(size, Image.BILINEAR))
+
+    def save(self, img_arr: NDArray, filename: str, title: str = "") -> str:
+        return save_frame(self.render(img_arr, title), filename)
+
+
+def save_frame(rendered: NDArray, filename: str) -> str:
+    """
+    Gezeichnetes Bild speichern, das Format folgt der Endung (z.B. ".png" oder ".jpg")
+    """
+    from PIL import Image
+    with stats.timer("write_frame", 1):
+        Image.fromarray(rendered).save(filename, compress_level=PNG_COMPRESS_LEVEL, quality=JPEG_QUALITY)
+    return filename
+
+
+def frame_title(a_time: np.datetime64) -> str:
+    return f"{np.datetime_as_string(np.datetime64(a_time, 'm'))} UTC"
+
+
+def _render_chunk(files: Sequence[str],
+                  titles: Sequence[str],
+                  out_files: Sequence[str],
+                  projection: MercatorProjection,
+                  lats: NDArray,
+                  lons: NDArray,
+                  mode: str,
+                  renderer_args: Dict) -> List[str]:
+    # ein Renderer je Aufruf, auch in den Worker-Prozessen - Figur und Marker gelten dann für den ganzen Block
+    renderer = BatchRenderer(projection, lats, lons, **renderer_args)
+    return [renderer.save(decode_frame(file, mode), out_file, title)
+            for file, title, out_file in zip(files, titles, out_files)]
+
+
+def render_frames(files: Sequence[str],
+                  times: ArrayLike,
+                  projection: MercatorProjection,
+                  lats: ArrayLike,
+                  lons: ArrayLike,
+                  out_dir: str,
+                  mode: str = "RGB",
+                  suffix: str = ".png",
+                  workers: int = 1,
+                  **renderer_args) -> List[str]:
+    """
+    Jedes Bild mit den Stationen nach out_dir schreiben (gleicher Name wie das Bild, Endung suffix), liefert die
+    Pfade
+
+    mode = "L" zeichnet die Graustufen, die der JPEG-Decoder direkt liefert. Mit workers > 1 werden die Bilder in
+    zusammenhängenden Blöcken auf einen Prozesspool verteilt, jeder Block nutzt eine eigene Figur. renderer_args
+    werden an BatchRenderer weitergegeben.
+    """
+    if suffix not in FRAME_SUFFIXES:
+        raise ValueError(f"Unknown frame suffix '{suffix}', expected one of: {FRAME_SUFFIXES}")
+    times = np.asarray(times, dtype="datetime64[m]").reshape(-1)
+    if len(times) != len(files):
+        raise ValueError(f"Expected a time for each image: {len(times)} != {len(files)}")
+    os.makedirs(out_dir, exist_ok=True)
+    files = [str(file) for file in files]
+    titles = [frame_title(a_time) for a_time in times]
+    out_files = [os.path.join(out_dir, os.path.splitext(os.path.basename(file))[0] + suffix) for file in files]
+    lats = np.asarray(lats, dtype="float64").reshape(-1)
+    lons = np.asarray(lons, dtype="float64").reshape(-1)
+    workers = max(1, min(workers, len(files)))
+    if workers == 1:
+        return _render_chunk(files, titles, out_files, projection, lats, lons, mode, renderer_args)
+    bounds = np.linspace(0, len(files), workers + 1).astype("int64")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_chunk, files[start:end], titles[start:end], out_files[start:end],
+                                   projection, lats, lons, mode, renderer_args)
+                   for start, end in zip(bounds[:-1], bounds[1:])]
+        return [out_file for future in futures for out_file in future.result()]
+
+
+def render_animation(files: Sequence[str],
+                     times: ArrayLike,
+                     projection: MercatorProjection,
+                     lats: ArrayLike,
+                     lons: ArrayLike,
+                     filename: str,
+                     fps: int = 10,
+                     mode: str = "RGB",
+                     **renderer_args) -> str:
+    """
+    Alle Bilder als Animation speichern, das Format folgt der Endung (siehe ANIMATION_SUFFIXES, ".png" = APNG)
+
+    Pillow schreibt die Animation erst am Ende, bis dahin liegen alle Einzelbilder im Speicher - für GIFs mit
+    256 Farben (ein Byte je Pixel). Für lange Zeiträume hilft ein kleineres scale.
+    """
+    from PIL import Image
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix not in ANIMATION_SUFFIXES:
+        raise ValueError(f"Unknown animation suffix '{suffix}', expected one of: {ANIMATION_SUFFIXES}")
+    times = np.asarray(times, dtype="datetime64[m]").reshape(-1)
+    if len(times) != len(files) or len(files) == 0:
+        raise ValueError(f"Expected at least one image and a time for each image: {len(times)}, {len(files)}")
+    renderer = BatchRenderer(projection, lats, lons, **renderer_args)
+    frames = []
+    for file, a_time in zip(files, times):
+        frame = Image.fromarray(renderer.render(decode_frame(str(file), mode), frame_title(a_time)))
+        if suffix == ".gif":
+            # selbst schnell auf 256 Farben reduzieren, sonst nutzt Pillow das langsamere Median-Cut-Verfahren
+            frame = frame.quantize(method=Image.Quantize.FASTOCTREE)
+        frames.append(frame)
+    with stats.timer("write_animation", len(frames)):
+        frames[0].save(filename, save_all=True, append_images=frames[1:], duration=round(1000 / fps), loop=0)
+    return filename
+
+
+def _range_indices(reader: "SatImgReader", start: datetime, end: datetime) -> NDArray:
+    first = np.searchsorted(reader.catalog.times, np.datetime64(start, "m"), side="left")
+    last = np.searchsorted(reader.catalog.times, np.datetime64(end, "m"), side="right")
+    return np.arange(first, last)
+
+
+def render_reader_range(reader: "SatImgReader",
+                        start: datetime,
+                        end: datetime,
+                        lats: ArrayLike,
+                        lons: ArrayLike,
+                        out_dir: str,
+                        suffix: str = ".png",
+                        workers: int = 1,
+                        **renderer_args) -> List[str]:
+    """
+    render_frames(...) für alle Bilder eines SatImgReader im Zeitraum [start, end], mit dessen Projektion und
+    Graugrenzwert
+    """
+    img_indices = _range_indices(reader, start, end)
+    renderer_args.setdefault("cloud_threshold", reader.cloud_threshold)
+    return render_frames(reader.catalog.files[img_indices], reader.catalog.times[img_indices], reader.projection,
+                         lats, lons, out_dir, suffix=suffix, workers=workers, **renderer_args)
+
+
+def render_reader_animation(reader: "SatImgReader",
+                            start: datetime,
+                            end: datetime,
+                            lats: ArrayLike,
+                            lons: ArrayLike,
+                            filename: str,
+                            fps: int = 10,
+                            **renderer_args) -> str:
+    img_indices = _range_indices(reader, start, end)
+    renderer_args.setdefault("cloud_threshold", reader.cloud_threshold)
+    return render_animation(reader.catalog.files[img_indices], reader.catalog.times[img_indices], reader.projection,
+                            lats, lons, filename, fps, **renderer_args)
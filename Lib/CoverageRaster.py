@@ -0,0 +1,58 @@
+import numpy as np
+from typing import Dict
+from numpy.typing import NDArray
+from Lib.MercatorProjection import MercatorProjection
+
+
+# Kennung für fehlende Werte, wenn das Raster als uint8-Prozentwerte gespeichert wird
+UINT8_NODATA: int = 255
+
+
+def save_coverage_raster(filename: str,
+                         times: NDArray,
+                         coverage: NDArray,
+                         projection: MercatorProjection,
+                         step: int = 1,
+                         radius: int | None = None,
+                         as_uint8: bool = True):
+    """
+    Bedeckungsraster (Zeit, Zeilen, Spalten) mit Georeferenzierung als komprimierte npz speichern
+
+    Neben den Grenzen und der Bildgröße der Projektion werden Breitengrad je Rasterzeile und Längengrad je
+    Rasterspalte (jeweils Pixelmitte) abgelegt. Mit as_uint8 werden die Prozentwerte gerundet als uint8 gespeichert,
+    NaN wird dabei zu UINT8_NODATA.
+    """
+    coverage = np.asarray(coverage)
+    rows = np.arange(0, projection.img_height, step)[:coverage.shape[1]]
+    cols = np.arange(0, projection.img_width, step)[:coverage.shape[2]]
+    row_lat, _ = projection.pixel_to_latlon(np.zeros(len(rows)), rows + 0.5)
+    _, col_lon = projection.pixel_to_latlon(cols + 0.5, np.zeros(len(cols)))
+    if as_uint8:
+        coverage = np.where(np.isnan(coverage), UINT8_NODATA, np.round(coverage)).astype("uint8")
+    np.savez_compressed(filename,
+                        times=np.asarray(times, dtype="datetime64[m]").astype("int64"),
+                        coverage=coverage,
+                        bounds=np.array([projection.min_lat, projection.max_lat,
+                                         projection.min_lon, projection.max_lon]),
+                        img_size=np.array([projection.img_width, projection.img_height]),
+                        step=np.array(step),
+                        radius=np.array(-1 if radius is None else radius),
+                        row_lat=row_lat,
+                        col_lon=col_lon)
+
+
+def load_coverage_raster(filename: str) -> Dict[str, NDArray | MercatorProjection]:
+    """
+    Gegenstück zu save_coverage_raster(...), uint8-Raster werden wieder zu float32-Prozentwerten mit NaN
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        result = {key: data[key] for key in data.files}
+    result["times"] = result["times"].astype("datetime64[m]")
+    if result["coverage"].dtype == np.uint8:
+        coverage = result["coverage"].astype("float32")
+        coverage[result["coverage"] == UINT8_NODATA] = np.nan
+        result["coverage"] = coverage
+    min_lat, max_lat, min_lon, max_lon = result["bounds"]
+    img_width, img_height = result["img_size"]
+    result["projection"] = MercatorProjection(min_lat, max_lat, min_lon, max_lon, int(img_width), int(img_height))
+    return result
@@ -0,0 +1,294 @@
+import os
+import json
+import math
+import socket
+import socketserver
+import threading
+import numpy as np
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from numpy.typing import NDArray
+from Lib.SatImgReader import SatImgReader, RESULT_ARRAYS, DEFAULT_RADIUS
+from Lib.ImgCatalog import MATCH_SLOT
+from Lib.Instrumentation import stats
+
+
+# Wie oft der Katalog im Hintergrund auf neue fusionierte Bilder geprüft wird
+DEFAULT_REFRESH_SECONDS: float = 60.0
+# Obergrenzen je Anfrage, damit ein einzelner Client den Dienst nicht blockiert
+MAX_BODY_BYTES: int = 64 * 1024 ** 2
+MAX_QUERY_ROWS: int = 5_000_000
+MAX_RADIUS: int = 1000
+MAX_TOLERANCE_MINUTES: float = 366 * 24 * 60
+
+# Form der Anfrage: Paare (times[i], coords[i]) oder alle Kombinationen times x coords
+QUERY_PAIRS: str = "pairs"
+QUERY_GRID: str = "grid"
+QUERY_MODES: List[str] = [QUERY_PAIRS, QUERY_GRID]
+
+
+class _ReadWriteLock:
+    """
+    Beliebig viele Anfragen gleichzeitig, die Aktualisierung des Katalogs aber allein
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            # neue Leser warten ab jetzt, laufende Anfragen werden noch beendet
+            self._writing = True
+            while self._readers > 0:
+                self._cond.wait()
+
+    def release_write(self):
+        with self._cond:
+            self._writing = False
+            self._cond.notify_all()
+
+
+class CoverageService:
+    """
+    Hält einen SatImgReader samt Katalog, Projektion und frame_cache dauerhaft im Speicher und beantwortet
+    Anfragen mehrerer Clients gleichzeitig
+
+    Gleichzeitige Anfragen, die dasselbe Bild brauchen, dekodieren es nur einmal (siehe FrameCache.load_once(...)).
+    Alle refresh_seconds Sekunden (oder per refresh()) werden neue oder geänderte Bilder in den Katalog
+    übernommen, ohne den Dienst neu zu starten - laufende Anfragen werden vorher beendet.
+    """
+    def __init__(self, reader: SatImgReader, refresh_seconds: float | None = DEFAULT_REFRESH_SECONDS):
+        if reader.projection is None:
+            raise ValueError(f"The initialize(...) function of SatPicReader was forgotten to be called.")
+        self.reader = reader
+        self.refresh_seconds = refresh_seconds
+        self.requests = 0
+        self.refreshes = 0
+        self._lock = _ReadWriteLock()
+        self._count_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher: threading.Thread | None = None
+
+    def start(self):
+        """
+        Katalog ab jetzt im Hintergrund aktualisieren
+        """
+        if self.refresh_seconds is None or self._refresher is not None:
+            return
+        self._stop.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="catalog-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except (OSError, ValueError) as e:
+                # z.B. ein Bild, das gerade geschrieben wird - beim nächsten Durchlauf erneut versuchen
+                print(f"Refreshing the catalog failed: {e}")
+
+    def refresh(self) -> Dict:
+        self._lock.acquire_write()
+        try:
+            with stats.timer("service_refresh"):
+                self.reader.refresh()
+            self.refreshes += 1
+        finally:
+            self._lock.release_write()
+        return self.status()
+
+    def status(self) -> Dict:
+        self._lock.acquire_read()
+        try:
+            catalog = self.reader.catalog
+            return {"images": len(catalog),
+                    "first_time": str(catalog.times[0]) if len(catalog) else None,
+                    "last_time": str(catalog.times[-1]) if len(catalog) else None,
+                    "cloud_threshold": self.reader.cloud_threshold,
+                    "requests": self.requests,
+                    "refreshes": self.refreshes,
+                    "frame_cache": self.reader.frame_cache.stats(),
+                    "instrumentation": stats.summary() if stats.enabled else None}
+        finally:
+            self._lock.release_read()
+
+    def coverage(self, request: Dict) -> Dict:
+        """
+        Bedeckungsgrade zu einer Anfrage als JSON-fähiges Dict
+
+        Die Anfrage enthält "times" (ISO-Zeitstempel in UTC) und "coords" ([lat, lon]-Paare), optional "query"
+        ("pairs" oder "grid" für alle Kombinationen), "match", "tolerance_minutes" (0 bis MAX_TOLERANCE_MINUTES) und
+        "radius" (Zahl oder Liste, 1 bis MAX_RADIUS) wie bei SatImgReader.get_cloud_coverage(...). Fehlende Werte
+        sind null.
+        """
+        times, coords, radius, tolerance = self._parse_query(request)
+        with self._count_lock:
+            self.requests += 1
+        self._lock.acquire_read()
+        try:
+            with stats.timer("service_request", len(times)):
+                columns = self.reader.get_cloud_coverage(times, coords,
+                                                         match=request.get("match", MATCH_SLOT),
+                                                         tolerance=tolerance,
+                                                         radius=radius,
+                                                         result=RESULT_ARRAYS)
+        finally:
+            self._lock.release_read()
+        return {name: _to_json_list(values) for name, values in columns.items()}
+
+    @staticmethod
+    def _parse_query(request: Dict) -> Tuple[NDArray, NDArray, int | List[int], timedelta | None]:
+        query = request.get("query", QUERY_PAIRS)
+        if query not in QUERY_MODES:
+            raise ValueError(f"Unknown query '{query}', expected one of: {QUERY_MODES}")
+        if "times" not in request or "coords" not in request:
+            raise ValueError("The request must contain 'times' and 'coords'.")
+        times = np.array(request["times"], dtype="datetime64[m]").reshape(-1)
+        coords = np.array(request["coords"], dtype="float64").reshape(-1, 2)
+        if query == QUERY_GRID:
+            num_rows = len(times) * len(coords)
+            if num_rows > MAX_QUERY_ROWS:
+                raise ValueError(f"The request has too many rows: {num_rows} > {MAX_QUERY_ROWS}")
+            times, coords = np.repeat(times, len(coords)), np.tile(coords, (len(times), 1))
+        elif len(times) != len(coords) and len(times) != 1 and len(coords) != 1:
+            raise ValueError(f"The times and coords must have the same length or one of them a length of 1: "
+                             f"{len(times)} != {len(coords)}")
+        if max(len(times), len(coords)) > MAX_QUERY_ROWS:
+            raise ValueError(f"The request has too many rows: {max(len(times), len(coords))} > {MAX_QUERY_ROWS}")
+
+        radius = request.get("radius", DEFAULT_RADIUS)
+        radii = radius if isinstance(radius, list) else [radius]
+        if not radii or not all(_is_number(a_radius) and 1 <= a_radius <= MAX_RADIUS for a_radius in radii):
+            raise ValueError(f"Every radius must be a number between 1 and {MAX_RADIUS}: {radius!r}")
+        radius = [int(a_radius) for a_radius in radii] if isinstance(radius, list) else int(radius)
+        tolerance = request.get("tolerance_minutes")
+        if tolerance is not None:
+            if not (_is_number(tolerance) and 0 <= tolerance <= MAX_TOLERANCE_MINUTES):
+                raise ValueError(f"The tolerance_minutes must be a number between 0 and {MAX_TOLERANCE_MINUTES}: "
+                                 f"{tolerance!r}")
+            tolerance = timedelta(minutes=float(tolerance))
+        return times, coords, radius, tolerance
+
+
+def _is_number(value) -> bool:
+    # JSON-Zahl ohne true/false, NaN und Unendlich
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _to_json_list(values: NDArray) -> List:
+    if np.issubdtype(values.dtype, np.datetime64):
+        return np.datetime_as_string(values, unit="m").tolist()
+    # NaN ist kein gültiges JSON
+    return [None if value != value else value for value in values.tolist()]
+
+
+class CoverageRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON über HTTP:
+        - POST /coverage: Anfrage siehe CoverageService.coverage(...), Antwort {Spaltenname: Werte}
+        - POST /refresh: Katalog sofort aktualisieren, Antwort wie /status
+        - GET /status: Anzahl Bilder, Zeitraum, Cache und Anzahl Anfragen
+    """
+    service: CoverageService
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        try:
+            if self.path == "/status":
+                self._send_json(200, self.service.status())
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_POST(self):
+        try:
+            if self.path == "/coverage":
+                self._send_json(200, self.service.coverage(self._read_json()))
+            elif self.path == "/refresh":
+                self._read_json()
+                self._send_json(200, self.service.refresh())
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+        except (ValueError, TypeError, KeyError) as e:
+            self._send_json(400, {"error": str(e)})
+        except OSError as e:
+            # z.B. ein Bild, das seit dem letzten Katalogstand gelöscht wurde
+            self._send_json(500, {"error": str(e)})
+        except Exception as e:
+            # keine Anfrage bleibt ohne Antwort
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"The request body is too large: {length} > {MAX_BODY_BYTES} bytes")
+        body = self.rfile.read(length) if length > 0 else b"{}"
+        request = json.loads(body)
+        if not isinstance(request, dict):
+            raise ValueError("The request body must be a JSON object.")
+        return request
+
+    def _send_json(self, code: int, content: Dict):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # bei Unix-Sockets ist die Client-Adresse leer
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format: str, *args):
+        if stats.enabled:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # eine verwaiste Socket-Datei eines beendeten Dienstes entfernen
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def make_server(service: CoverageService,
+                host: str = "127.0.0.1",
+                port: int = 8765,
+                socket_path: str | None = None) -> socketserver.BaseServer:
+    """
+    HTTP-Server für den Dienst, mit socket_path auf einem Unix-Socket statt auf host:port
+    """
+    handler = type("BoundCoverageRequestHandler", (CoverageRequestHandler,), {"service": service})
+    if socket_path is not None:
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix sockets are not supported on this platform.")
+        return UnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,335 @@
+import numpy as np
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from numpy.typing import NDArray, ArrayLike
+from Lib.SatImgReader import SatImgReader, RESULT_ARRAYS, COL_CLOUDCOV, DEFAULT_RADIUS
+from Lib.ImgCatalog import MATCH_SLOT
+from Lib.ThresholdOptimizer import hour_of_day, BY_ALL, BY_STATION, BY_HOUR
+from Lib.Instrumentation import stats
+
+
+# Kennzahlen der Abweichung Quelle - Referenz in Prozentpunkten
+STAT_COUNT: str = "count"
+STAT_MAE: str = "mae"
+STAT_BIAS: str = "bias"
+STAT_RMSE: str = "rmse"
+STAT_NAMES: List[str] = [STAT_COUNT, STAT_MAE, STAT_BIAS, STAT_RMSE]
+
+# Spalten des Bedeckungsgrades in Achteln und des Zeitstempels (JJJJMMTTHH, UTC) in den DWD-Stationsdaten
+DWD_COL_OKTA: str = "V_N"
+DWD_COL_DATE: str = "MESS_DATUM"
+# Spalte des Gültigkeitszeitpunkts in den Ergebnissen des Grib2-Lesers
+GRIB_COL_DATE: str = "valid_time"
+
+
+def time_grid(start: datetime, end: datetime, step: timedelta = timedelta(hours=1)) -> NDArray:
+    """
+    Zeitpunkte im Abstand step bis einschließlich end als datetime64[m]
+
+    Das Raster beginnt nicht bei start selbst, sondern am letzten Vielfachen von step (ab Mitternacht) davor, bei
+    step = 1 Stunde also zur vollen Stunde wie die Stationsmeldungen.
+    """
+    step_minutes = int(step.total_seconds() // 60)
+    if step_minutes < 1:
+        raise ValueError(f"The step of the time grid must be at least one minute: {step}")
+    first, last = np.datetime64(start, "m"), np.datetime64(end, "m")
+    first -= np.timedelta64(int(first.astype("int64")) % step_minutes, "m")
+    return np.arange(first, last + np.timedelta64(1, "m"), np.timedelta64(step_minutes, "m"))
+
+
+class CoverageSource(ABC):
+    """
+    Quelle für Bedeckungsgrade in % an Stationen, z.B. Satellitenbilder, Modelldaten oder Stationsmeldungen
+
+    fetch(...) liefert die Werte in Langform als drei gleich lange Arrays (Zeitpunkte, Stationsindex, Werte). Die
+    Zeitpunkte müssen nicht mit den angefragten übereinstimmen, die EvaluationEngine ordnet sie über den
+    Zeitstempel zu - Werte zu anderen Zeitpunkten werden verworfen. Eigene Quellen (z.B. Testdaten) leiten von
+    dieser Klasse ab oder nutzen ArraySource.
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    @abstractmethod
+    def fetch(self, times: NDArray, lats: NDArray, lons: NDArray) -> Tuple[NDArray, NDArray, NDArray]:
+        pass
+
+
+class ArraySource(CoverageSource):
+    """
+    Feste Werte in Langform, z.B. vorab geladene Daten oder Testdaten ohne externe Leser
+    """
+    def __init__(self, name: str, times: ArrayLike, stations: ArrayLike, values: ArrayLike):
+        super().__init__(name)
+        self.times = np.asarray(times, dtype="datetime64[m]").reshape(-1)
+        self.stations = np.asarray(stations, dtype="int64").reshape(-1)
+        self.values = np.asarray(values, dtype="float64").reshape(-1)
+        if not self.times.shape == self.stations.shape == self.values.shape:
+            raise ValueError(f"The times, stations and values of the source '{name}' must have the same length: "
+                             f"{self.times.shape}, {self.stations.shape}, {self.values.shape}")
+
+    @classmethod
+    def from_matrix(cls, name: str, times: ArrayLike, values: ArrayLike) -> "ArraySource":
+        """
+        Aus einer Matrix (Anzahl Zeitpunkte, Anzahl Stationen), z.B. den Referenzwerten eines StationStore
+        """
+        values = np.asarray(values, dtype="float64")
+        times = np.asarray(times, dtype="datetime64[m]").reshape(-1)
+        if values.ndim != 2 or values.shape[0] != len(times):
+            raise ValueError(f"Expected a ({len(times)}, stations) matrix for the source '{name}', "
+                             f"got the shape {values.shape}")
+        num_stations = values.shape[1]
+        return cls(name, np.repeat(times, num_stations), np.tile(np.arange(num_stations), len(times)),
+                   values.reshape(-1))
+
+    def fetch(self, times: NDArray, lats: NDArray, lons: NDArray) -> Tuple[NDArray, NDArray, NDArray]:
+        return self.times, self.stations, self.values
+
+
+class SatelliteSource(CoverageSource):
+    """
+    Bedeckungsgrade aus den Satellitenbildern, alle Zeitpunkte und Stationen in einer einzigen Abfrage
+    """
+    def __init__(self,
+                 reader: SatImgReader,
+                 name: str = "Satellite",
+                 match: str = MATCH_SLOT,
+                 tolerance: timedelta | None = None,
+                 radius: int = DEFAULT_RADIUS,
+                 workers: int = 1):
+        super().__init__(name)
+        self.reader = reader
+        self.match = match
+        self.tolerance = tolerance
+        self.radius = radius
+        self.workers = workers
+
+    def fetch(self, times: NDArray, lats: NDArray, lons: NDArray) -> Tuple[NDArray, NDArray, NDArray]:
+        num_stations = len(lats)
+        query_times = np.repeat(times, num_stations)
+        stations = np.tile(np.arange(num_stations), len(times))
+        coords = np.stack([lats[stations], lons[stations]], axis=1)
+        result = self.reader.get_cloud_coverage(query_times, coords, self.match, self.tolerance, self.radius,
+                                                self.workers, result=RESULT_ARRAYS)
+        return query_times, stations, result[COL_CLOUDCOV]
+
+
+class DWDStationSource(CoverageSource):
+    """
+    Gemeldete Bedeckungsgrade der DWD-Stationen über einen DWDStationReader.DWDStations (Achtel -> %)
+
+    Der Leser wird je Station mit get_values(Zeitpunkte, lat, lon) abgefragt, die Zeilen werden über den Zeitstempel
+    in time_column zugeordnet. Mit time_column=None gehören die Zeilen der Reihe nach zu den angefragten
+    Zeitpunkten, dann muss es genau eine Zeile je Zeitpunkt geben. Meldungen außerhalb von 0..8 Achteln
+    (z.B. 9 = Himmel nicht erkennbar, -1 = fehlt) gelten als fehlend.
+    """
+    def __init__(self, dwd_data, name: str = "DWD", time_column: str | None = DWD_COL_DATE):
+        super().__init__(name)
+        self.dwd_data = dwd_data
+        self.time_column = time_column
+
+    def fetch(self, times: NDArray, lats: NDArray, lons: NDArray) -> Tuple[NDArray, NDArray, NDArray]:
+        date_list = times.astype("datetime64[s]").tolist()
+        parts = []
+        for station, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist())):
+            res = self.dwd_data.get_values(date_list, lat, lon)
+            okta = np.asarray(res[DWD_COL_OKTA], dtype="float64") if not res.empty else np.empty(0)
+            okta = np.where((okta >= 0) & (okta <= 8), okta, np.nan)
+            parts.append(_station_rows(self.name, res, self.time_column, times, station, okta / 8 * 100))
+        return _concat_rows(parts)
+
+
+class GribSource(CoverageSource):
+    """
+    Modellwerte (z.B. ICON-D2 Gesamtbedeckung in %) über einen Grib2Reader.Grib2Datas
+
+    Abgefragt wird je Station mit get_values(model, variable, Zeitpunkte, (lat, lon)), die Zuordnung der Zeilen
+    erfolgt wie bei DWDStationSource.
+    """
+    def __init__(self, grib_data, model: str, variable: str, name: str | None = None,
+                 time_column: str | None = GRIB_COL_DATE):
+        super().__init__(name if name is not None else model)
+        self.grib_data = grib_data
+        self.model = model
+        self.variable = variable
+        self.time_column = time_column
+
+    def fetch(self, times: NDArray, lats: NDArray, lons: NDArray) -> Tuple[NDArray, NDArray, NDArray]:
+        date_list = times.astype("datetime64[s]").tolist()
+        parts = []
+        for station, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist())):
+            res = self.grib_data.get_values(self.model, self.variable, date_list, (lat, lon))
+            values = np.asarray(res[self.variable], dtype="float64") if not res.empty else np.empty(0)
+            parts.append(_station_rows(self.name, res, self.time_column, times, station, values))
+        return _concat_rows(parts)
+
+
+def _station_rows(name: str, res, time_column: str | None, times: NDArray, station: int,
+                  values: NDArray) -> Tuple[NDArray, NDArray, NDArray]:
+    # Zeilen eines externen Lesers in Langform bringen
+    if res.empty:
+        row_times = np.empty(0, dtype="datetime64[m]")
+    elif time_column is not None:
+        if time_column not in res:
+            raise ValueError(f"The result of the source '{name}' has no time column '{time_column}': "
+                             f"{list(res.columns)}")
+        row_times = _to_utc_minutes(res[time_column])
+    elif len(values) == len(times):
+        row_times = times
+    else:
+        # ohne Zeitspalte würde jede fehlende Zeile alle folgenden Werte verschieben
+        raise ValueError(f"The source '{name}' returned {len(values)} rows for {len(times)} times at station "
+                         f"{station}, the rows can only be matched by a time column.")
+    return row_times, np.full(len(values), station, dtype="int64"), values
+
+
+def _to_utc_minutes(column) -> NDArray:
+    """
+    Zeitspalte eines DataFrames als datetime64[m] in UTC, ganze Zahlen im DWD-Format JJJJMMTTHH
+    """
+    import pandas as pd
+    if pd.api.types.is_integer_dtype(column):
+        column = pd.to_datetime(column.astype(str), format="%Y%m%d%H")
+    return pd.to_datetime(column, utc=True).dt.tz_localize(None).to_numpy(dtype="datetime64[m]")
+
+
+def _concat_rows(parts: List[Tuple[NDArray, NDArray, NDArray]]) -> Tuple[NDArray, NDArray, NDArray]:
+    if not parts:
+        return np.empty(0, dtype="datetime64[m]"), np.empty(0, dtype="int64"), np.empty(0)
+    return tuple(np.concatenate([part[col] for part in parts]) for col in range(3))
+
+
+def align_values(times: NDArray,
+                 num_stations: int,
+                 src_times: ArrayLike,
+                 src_stations: ArrayLike,
+                 src_values: ArrayLike) -> NDArray:
+    """
+    Werte in Langform auf das Raster (Anzahl Zeitpunkte, Anzahl Stationen) legen
+
+    times muss aufsteigend sortiert sein, die Zeitpunkte werden darin per Binärsuche gesucht und nur exakte Treffer
+    (auf die Minute) zählen.
+    Mehrere Werte für dasselbe Paar aus Zeitpunkt und Station werden gemittelt, NaN-Werte ignoriert. Paare ohne
+    Wert sind NaN.
+    """
+    src_times = np.asarray(src_times, dtype="datetime64[m]").reshape(-1)
+    src_stations = np.asarray(src_stations, dtype="int64").reshape(-1)
+    src_values = np.asarray(src_values, dtype="float64").reshape(-1)
+    if len(times) == 0:
+        return np.empty((0, num_stations))
+    pos = np.minimum(np.searchsorted(times, src_times), len(times) - 1)
+    valid = (times[pos] == src_times) & (src_stations >= 0) & (src_stations < num_stations) & ~np.isnan(src_values)
+    cells = pos[valid] * num_stations + src_stations[valid]
+    size = len(times) * num_stations
+    counts = np.bincount(cells, minlength=size)
+    sums = np.bincount(cells, weights=src_values[valid], minlength=size)
+    aligned = np.full(size, np.nan)
+    np.divide(sums, counts, out=aligned, where=counts > 0)
+    return aligned.reshape(len(times), num_stations)
+
+
+def error_stats(values: NDArray, ref: NDArray, groups: NDArray, num_groups: int) -> Dict[str, NDArray]:
+    """
+    Anzahl, MAE, Bias (Mittel von Wert - Referenz) und RMSE je Gruppe 0..num_groups - 1 in einem Durchlauf
+
+    Paare mit NaN werden ignoriert, Gruppen ohne gültige Paare sind NaN.
+    """
+    valid = ~(np.isnan(values) | np.isnan(ref))
+    diff = (values - ref)[valid]
+    group = np.broadcast_to(groups, values.shape)[valid]
+    counts = np.bincount(group, minlength=num_groups).astype("float64")
+    result = {STAT_COUNT: counts.astype("int64")}
+    for stat_name, weights in ((STAT_MAE, np.abs(diff)), (STAT_BIAS, diff), (STAT_RMSE, diff ** 2)):
+        mean = np.full(num_groups, np.nan)
+        np.divide(np.bincount(group, weights=weights, minlength=num_groups), counts, out=mean, where=counts > 0)
+        result[stat_name] = mean
+    result[STAT_RMSE] = np.sqrt(result[STAT_RMSE])
+    return result
+
+
+class EvaluationEngine:
+    """
+    Vergleicht mehrere Quellen von Bedeckungsgraden mit einer Referenz für alle Stationen und Zeitpunkte
+
+    Jede Quelle wird einmal für alle Zeitpunkte und Stationen abgefragt (siehe CoverageSource) und über
+    Zeitstempel und Stationsindex auf ein gemeinsames Raster gelegt. Die Fehler werden dann für jede Quelle
+    gegenüber der Referenz gesamt, je Station und je Stunde (UTC) berechnet.
+    """
+    def __init__(self,
+                 lats: ArrayLike,
+                 lons: ArrayLike,
+                 reference: CoverageSource,
+                 sources: List[CoverageSource]):
+        self.lats: NDArray = np.asarray(lats, dtype="float64").reshape(-1)
+        self.lons: NDArray = np.asarray(lons, dtype="float64").reshape(-1)
+        if self.lats.shape != self.lons.shape:
+            raise ValueError(f"The latitudes and longitudes must have the same length: "
+                             f"{self.lats.shape} != {self.lons.shape}")
+        names = [reference.name] + [source.name for source in sources]
+        if len(set(names)) != len(names):
+            raise ValueError(f"The names of the sources must be unique: {names}")
+        self.reference = reference
+        self.sources = sources
+
+    @property
+    def num_stations(self) -> int:
+        return len(self.lats)
+
+    def collect(self, times: ArrayLike) -> Dict[str, NDArray]:
+        """
+        Werte aller Quellen (und der Referenz) als Matrizen (Anzahl Zeitpunkte, Anzahl Stationen) je Name
+        """
+        times = np.unique(np.asarray(times, dtype="datetime64[m]").reshape(-1))
+        aligned = {}
+        for source in [self.reference] + self.sources:
+            with stats.timer(f"fetch_{source.name}"):
+                src_times, src_stations, src_values = source.fetch(times, self.lats, self.lons)
+            with stats.timer("align", len(src_values)):
+                aligned[source.name] = align_values(times, self.num_stations, src_times, src_stations, src_values)
+        return aligned
+
+    def evaluate(self,
+                 times: ArrayLike,
+                 aligned: Dict[str, NDArray] | None = None) -> Dict[str, Dict[str, Dict[str, NDArray]]]:
+        """
+        Fehlerkennzahlen jeder Quelle gegenüber der Referenz, als result[Quelle][Gruppierung][Kennzahl]
+
+        Gruppierungen: "all" (Arrays der Länge 1), "station" (je Station) und "hour" (je Stunde 0..23 UTC).
+        Kennzahlen: siehe STAT_NAMES. Mit aligned können schon gesammelte Werte (siehe collect(...)) zu denselben
+        times übergeben werden.
+        """
+        times = np.unique(np.asarray(times, dtype="datetime64[m]").reshape(-1))
+        if aligned is None:
+            aligned = self.collect(times)
+        ref = aligned[self.reference.name]
+        groups = {BY_ALL: (np.zeros((1, 1), dtype="int64"), 1),
+                  BY_STATION: (np.arange(self.num_stations)[None, :], self.num_stations),
+                  BY_HOUR: (hour_of_day(times)[:, None], 24)}
+        result = {}
+        for source in self.sources:
+            with stats.timer("error_stats", ref.size):
+                result[source.name] = {by: error_stats(aligned[source.name], ref, by_groups, num_groups)
+                                       for by, (by_groups, num_groups) in groups.items()}
+        return result
+
+    def evaluate_range(self,
+                       start: datetime,
+                       end: datetime,
+                       step: timedelta = timedelta(hours=1)) -> Dict[str, Dict[str, Dict[str, NDArray]]]:
+        return self.evaluate(time_grid(start, end, step))
+
+
+def format_evaluation(result: Dict[str, Dict[str, Dict[str, NDArray]]], by: str = BY_ALL) -> str:
+    """
+    Kennzahlen einer Gruppierung als lesbare Tabelle, bei "station" und "hour" eine Zeile je Gruppe
+    """
+    lines = [f"{'source':<16} {by:>8} {STAT_COUNT:>8} {STAT_MAE:>8} {STAT_BIAS:>8} {STAT_RMSE:>8}"]
+    for name, by_stats in result.items():
+        values = by_stats[by]
+        for group in range(len(values[STAT_COUNT])):
+            if values[STAT_COUNT][group] == 0:
+                continue
+            lines.append(f"{name:<16} {group if by != BY_ALL else '':>8} {values[STAT_COUNT][group]:>8} "
+                         f"{values[STAT_MAE][group]:>8.2f} {values[STAT_BIAS][group]:>8.2f} "
+                         f"{values[STAT_RMSE][group]:>8.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,138 @@
+import os.path
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple
+from numpy.typing import NDArray
+from Lib.Instrumentation import stats
+
+
+# Standardbudget für dekodierte Bilder: 256 MiB
+DEFAULT_CACHE_BYTES: int = 256 * 1024 ** 2
+
+
+class FrameCache:
+    """
+    LRU-Cache für dekodierte Bilder (z.B. uint8-Graustufen-Arrays)
+
+    Die Einträge werden über den Dateipfad und die Änderungszeit der Datei identifiziert, ein neu geschriebenes
+    Bild wird also automatisch neu dekodiert. Verdrängt wird nicht nach Anzahl der Einträge, sondern sobald die
+    Summe der gespeicherten Bytes das Budget max_bytes überschreitet.
+
+    Der Cache ist threadsicher. Mit load_once(...) lädt bei gleichzeitigen Anfragen nach demselben Bild nur ein
+    Thread, die anderen warten auf dessen Ergebnis.
+    """
+    def __init__(self,
+                 max_bytes: int = DEFAULT_CACHE_BYTES):
+        if max_bytes < 0:
+            raise ValueError(f"The byte budget of the FrameCache must not be negative: {max_bytes}")
+        self.max_bytes = max_bytes
+        self.cur_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._frames: OrderedDict[Hashable, NDArray] = OrderedDict()
+        self._lock = threading.Lock()
+        # Schlüssel, die gerade von einem Thread geladen werden, und das Ereignis, auf das die anderen warten
+        self._loading: Dict[Hashable, threading.Event] = {}
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    @staticmethod
+    def make_key(filename: str, mode: str = "L") -> Tuple[str, int, str]:
+        return os.path.abspath(filename), os.stat(filename).st_mtime_ns, mode
+
+    def get(self, key: Hashable) -> NDArray | None:
+        with self._lock:
+            return self._get(key)
+
+    def peek(self, key: Hashable) -> NDArray | None:
+        """
+        Wie get(...), ein fehlendes Bild zählt aber nicht als Fehlzugriff
+
+        Für das Nachsehen vor einem Zugriff unter anderem Schlüssel (z.B. Teilbild statt ganzem Bild), der den
+        Fehlzugriff dann selbst zählt.
+        """
+        with self._lock:
+            return self._get(key, count_miss=False)
+
+    def _get(self, key: Hashable, count_miss: bool = True) -> NDArray | None:
+        frame = self._frames.get(key)
+        if frame is None:
+            if count_miss:
+                self.misses += 1
+                stats.count("cache_misses")
+            return None
+        self.hits += 1
+        stats.count("cache_hits")
+        self._frames.move_to_end(key)
+        return frame
+
+    def put(self, key: Hashable, frame: NDArray):
+        with self._lock:
+            self._put(key, frame)
+
+    def _put(self, key: Hashable, frame: NDArray):
+        if key in self._frames:
+            self.cur_bytes -= self._frames.pop(key).nbytes
+        # Bilder, die allein schon das Budget sprengen, werden nicht gespeichert
+        if frame.nbytes > self.max_bytes:
+            return
+        # Gespeicherte Bilder dürfen vom Aufrufer nicht verändert werden
+        frame.setflags(write=False)
+        self._frames[key] = frame
+        self.cur_bytes += frame.nbytes
+        while self.cur_bytes > self.max_bytes:
+            _, evicted = self._frames.popitem(last=False)
+            self.cur_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def get_or_load(self,
+                    filename: str,
+                    loader: Callable[[str], NDArray],
+                    mode: str = "L") -> NDArray:
+        return self.load_once(self.make_key(filename, mode), lambda: loader(filename))
+
+    def load_once(self, key: Hashable, loader: Callable[[], NDArray]) -> NDArray:
+        """
+        Bild aus dem Cache oder mit loader() laden und speichern
+
+        Lädt ein anderer Thread gerade dasselbe Bild, wird auf ihn gewartet statt erneut zu dekodieren. Schlägt
+        sein Laden fehl, versucht es der nächste wartende Thread selbst.
+        """
+        while True:
+            with self._lock:
+                frame = self._get(key)
+                if frame is not None:
+                    return frame
+                event = self._loading.get(key)
+                if event is None:
+                    event = self._loading[key] = threading.Event()
+                    break
+            event.wait()
+            stats.count("cache_coalesced")
+        try:
+            frame = loader()
+            with self._lock:
+                self._put(key, frame)
+            return frame
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.cur_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._frames),
+                "bytes": self.cur_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
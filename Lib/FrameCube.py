@@ -0,0 +1,223 @@
+import os
+import json
+import numpy as np
+from datetime import timedelta
+from typing import Tuple
+from numpy.typing import NDArray, ArrayLike
+from Lib.ImgCatalog import ImgCatalog, MATCH_EXACT
+from Lib.FrameDecoder import decode_frame, image_size
+
+
+CUBE_META_FILE: str = "cube_meta.json"
+CUBE_DATA_FILE: str = "frames.u8"
+CUBE_TIMES_FILE: str = "times.npy"
+# Änderungszeiten (st_mtime_ns) der Quelldateien, fehlt die Datei (ältere Würfel), gelten sie als unbekannt (0)
+CUBE_MTIMES_FILE: str = "mtimes.npy"
+CUBE_VERSION: int = 1
+
+
+class FrameCube:
+    """
+    Graustufen-Archiv als memory-mapped uint8-Würfel der Form (Zeit, Höhe, Breite)
+
+    Alle Bilder des Archivs haben die gleiche Geometrie, daher liegen die Pixel hintereinander in CUBE_DATA_FILE.
+    Die Zeitstempel stehen in CUBE_TIMES_FILE, die Änderungszeiten der Quelldateien in CUBE_MTIMES_FILE, Höhe und
+    Breite in CUBE_META_FILE. Neue Bilder werden angehängt, neu geschriebene Quelldateien mit replace(...) an ihrem
+    Platz ersetzt. Der Zugriff auf ein Bild liefert eine Sicht in die gemappte Datei, es wird weder dekodiert noch
+    kopiert.
+    """
+    def __init__(self, cube_dir: str):
+        if not FrameCube.is_cube(cube_dir):
+            raise ValueError(f"There is no FrameCube in: {cube_dir}")
+        self.cube_dir = os.path.abspath(cube_dir)
+        with open(os.path.join(self.cube_dir, CUBE_META_FILE), "r") as meta_file:
+            meta = json.load(meta_file)
+        if meta["version"] != CUBE_VERSION:
+            raise ValueError(f"Unsupported FrameCube version {meta['version']} in: {cube_dir}")
+        self.img_height: int = meta["height"]
+        self.img_width: int = meta["width"]
+        self.times: NDArray = np.load(os.path.join(self.cube_dir, CUBE_TIMES_FILE)).astype("datetime64[m]")
+        mtimes_file = os.path.join(self.cube_dir, CUBE_MTIMES_FILE)
+        self.mtimes: NDArray = np.zeros(len(self.times), dtype="int64")
+        if os.path.isfile(mtimes_file):
+            mtimes = np.load(mtimes_file).astype("int64")
+            # nach einem abgebrochenen Anhängen können die Änderungszeiten länger sein als die Zeitstempel
+            self.mtimes[:min(len(mtimes), len(self.times))] = mtimes[:len(self.times)]
+        self._data: np.memmap | None = None
+        self._index = ImgCatalog(self.times, np.full(len(self.times), self.data_file))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def data_file(self) -> str:
+        return os.path.join(self.cube_dir, CUBE_DATA_FILE)
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.img_height * self.img_width
+
+    @staticmethod
+    def is_cube(cube_dir: str) -> bool:
+        return os.path.isfile(os.path.join(cube_dir, CUBE_META_FILE))
+
+    @classmethod
+    def create(cls, cube_dir: str, img_width: int, img_height: int) -> "FrameCube":
+        os.makedirs(cube_dir, exist_ok=True)
+        if FrameCube.is_cube(cube_dir):
+            raise ValueError(f"There is already a FrameCube in: {cube_dir}")
+        np.save(os.path.join(cube_dir, CUBE_TIMES_FILE), np.array([], dtype="datetime64[m]").astype("int64"))
+        np.save(os.path.join(cube_dir, CUBE_MTIMES_FILE), np.array([], dtype="int64"))
+        open(os.path.join(cube_dir, CUBE_DATA_FILE), "wb").close()
+        # Meta-Datei zuletzt schreiben, erst sie macht den Ordner zu einem FrameCube
+        with open(os.path.join(cube_dir, CUBE_META_FILE), "w") as meta_file:
+            json.dump({"version": CUBE_VERSION, "height": img_height, "width": img_width}, meta_file)
+        return cls(cube_dir)
+
+    @property
+    def data(self) -> NDArray:
+        """
+        Alle Bilder als (Zeit, Höhe, Breite)-Array, nur lesend in den Speicher gemappt
+        """
+        if self._data is None:
+            if len(self.times) == 0:
+                return np.empty((0, self.img_height, self.img_width), dtype="uint8")
+            self._data = np.memmap(self.data_file, dtype="uint8", mode="r",
+                                   shape=(len(self.times), self.img_height, self.img_width))
+        return self._data
+
+    def frame(self, frame_idx: int) -> NDArray:
+        return self.data[frame_idx]
+
+    def lookup(self,
+               query_times: ArrayLike,
+               match: str = MATCH_EXACT,
+               tolerance: timedelta | None = None,
+               mtimes: ArrayLike | None = None) -> NDArray:
+        """
+        Liefert für jeden Zeitpunkt den Index des Bildes im Würfel oder -1 (siehe ImgCatalog.lookup)
+
+        Mit mtimes (Änderungszeiten der Quelldateien, z.B. ImgCatalog.mtimes) gelten Bilder, deren Quelldatei
+        seit dem Übernehmen in den Würfel neu geschrieben wurde, als nicht enthalten.
+        """
+        pos = self._index.lookup(query_times, match, tolerance)
+        if len(self.times) == 0:
+            return pos
+        frame_idx = np.where(pos >= 0, self._index.order[np.maximum(pos, 0)], -1)
+        if mtimes is not None:
+            mtimes = np.asarray(mtimes, dtype="int64").reshape(-1)
+            frame_idx[self.mtimes[np.maximum(frame_idx, 0)] != mtimes] = -1
+        return frame_idx
+
+    def append(self, times: ArrayLike, frames: NDArray, mtimes: ArrayLike | None = None):
+        """
+        Bilder der Form (n, Höhe, Breite) oder (Höhe, Breite) als uint8 an den Würfel anhängen, optional mit den
+        Änderungszeiten ihrer Quelldateien
+        """
+        times = np.asarray(times, dtype="datetime64[m]").reshape(-1)
+        frames = np.asarray(frames, dtype="uint8").reshape(-1, self.img_height, self.img_width)
+        mtimes = np.zeros(len(times), "int64") if mtimes is None else np.asarray(mtimes, dtype="int64").reshape(-1)
+        if not len(times) == len(frames) == len(mtimes):
+            raise ValueError(f"The number of times, frames and mtimes must be the same: "
+                             f"{len(times)}, {len(frames)}, {len(mtimes)}")
+        # Sicht auf die alte Dateigröße vor dem Anhängen freigeben
+        self._data = None
+        with open(self.data_file, "r+b") as data_file:
+            # Reste eines abgebrochenen Anhängens abschneiden
+            data_file.truncate(len(self.times) * self.frame_bytes)
+            data_file.seek(0, os.SEEK_END)
+            data_file.write(np.ascontiguousarray(frames).tobytes())
+        # Zeitstempel zuletzt speichern, so zählen nur vollständig geschriebene Bilder
+        self.mtimes = np.concatenate([self.mtimes, mtimes])
+        self._save_array(CUBE_MTIMES_FILE, self.mtimes)
+        self.times = np.concatenate([self.times, times])
+        self._save_array(CUBE_TIMES_FILE, self.times.astype("int64"))
+        self._index = ImgCatalog(self.times, np.full(len(self.times), self.data_file))
+
+    def replace(self, frame_idx: ArrayLike, frames: NDArray, mtimes: ArrayLike):
+        """
+        Bilder an den Positionen frame_idx überschreiben, z.B. wenn ihre Quelldatei neu geschrieben wurde
+        """
+        frame_idx = np.asarray(frame_idx, dtype="int64").reshape(-1)
+        frames = np.asarray(frames, dtype="uint8").reshape(-1, self.img_height, self.img_width)
+        mtimes = np.asarray(mtimes, dtype="int64").reshape(-1)
+        if not len(frame_idx) == len(frames) == len(mtimes):
+            raise ValueError(f"The number of indices, frames and mtimes must be the same: "
+                             f"{len(frame_idx)}, {len(frames)}, {len(mtimes)}")
+        self._data = None
+        with open(self.data_file, "r+b") as data_file:
+            for an_idx, frame in zip(frame_idx.tolist(), frames):
+                data_file.seek(an_idx * self.frame_bytes)
+                data_file.write(np.ascontiguousarray(frame).tobytes())
+        # bis hier gilt das Bild über die alte Änderungszeit noch als veraltet
+        self.mtimes[frame_idx] = mtimes
+        self._save_array(CUBE_MTIMES_FILE, self.mtimes)
+
+    def _save_array(self, filename: str, values: NDArray):
+        tmp_file = os.path.join(self.cube_dir, f"tmp_{filename}")
+        np.save(tmp_file, values)
+        os.replace(tmp_file, os.path.join(self.cube_dir, filename))
+
+    def window_series(self,
+                      rows: ArrayLike,
+                      cols: ArrayLike,
+                      radius: int = 4,
+                      frame_idx: ArrayLike | None = None) -> NDArray:
+        """
+        Zeitreihen der Fenstermittelwerte [row - radius, row + radius) x [col - radius, col + radius)
+
+        Liefert ein Array der Form (Anzahl Bilder, Anzahl Punkte). Jedes Fenster wird als ein gestrideter Zugriff
+        entlang der Zeitachse gelesen. Fenster werden auf das Bild beschnitten, komplett außerhalb liegende
+        Fenster ergeben NaN.
+        """
+        rows = np.asarray(rows, dtype="int64").reshape(-1)
+        cols = np.asarray(cols, dtype="int64").reshape(-1)
+        frame_idx = slice(None) if frame_idx is None else np.asarray(frame_idx, dtype="int64")
+        num_frames = len(self.times) if isinstance(frame_idx, slice) else len(frame_idx)
+        result = np.full((num_frames, len(rows)), np.nan)
+        for col_idx, (row, col) in enumerate(zip(rows, cols)):
+            (r0, r1), (c0, c1) = self._clip_window(row, col, radius)
+            if r0 < r1 and c0 < c1:
+                # erst das Fenster als Sicht über alle Zeiten wählen, dann nur dessen Pixel kopieren
+                result[:, col_idx] = self.data[:, r0:r1, c0:c1][frame_idx].mean(axis=(1, 2), dtype="float64")
+        return result
+
+    def _clip_window(self, row: int, col: int, radius: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        r0, r1 = max(row - radius, 0), min(row + radius, self.img_height)
+        c0, c1 = max(col - radius, 0), min(col + radius, self.img_width)
+        return (r0, r1), (c0, c1)
+
+
+def build_frame_cube(catalog: ImgCatalog, cube_dir: str, batch_size: int = 64) -> FrameCube:
+    """
+    Alle Bilder des Katalogs, die noch nicht im Würfel stehen, als Graustufen dekodieren und anhängen
+
+    Bilder, deren Quelldatei seit dem Übernehmen neu geschrieben wurde, werden an ihrem Platz ersetzt. Existiert in
+    cube_dir noch kein FrameCube, wird er mit der Größe des ersten Bildes angelegt.
+    """
+    if FrameCube.is_cube(cube_dir):
+        cube = FrameCube(cube_dir)
+    else:
+        if len(catalog) == 0:
+            raise ValueError("The catalog for the FrameCube contains no images.")
+        img_width, img_height = image_size(catalog.files[0])
+        cube = FrameCube.create(cube_dir, img_width, img_height)
+
+    frame_idx = cube.lookup(catalog.times)
+    current = cube.lookup(catalog.times, mtimes=catalog.mtimes) >= 0
+    for missing, stale in ((frame_idx < 0, False), ((frame_idx >= 0) & ~current, True)):
+        rows = np.flatnonzero(missing)
+        for start in range(0, len(rows), batch_size):
+            part = rows[start:start + batch_size]
+            frames = np.empty((len(part), cube.img_height, cube.img_width), dtype="uint8")
+            for pos, img_idx in enumerate(part):
+                frame = decode_frame(catalog.files[img_idx])
+                if frame.shape != (cube.img_height, cube.img_width):
+                    raise ValueError(f"The image {catalog.files[img_idx]} has the size {frame.shape[::-1]}, "
+                                     f"the FrameCube expects {(cube.img_width, cube.img_height)}.")
+                frames[pos] = frame
+            if stale:
+                cube.replace(frame_idx[part], frames, catalog.mtimes[part])
+            else:
+                cube.append(catalog.times[part], frames, catalog.mtimes[part])
+    return cube
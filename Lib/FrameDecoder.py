@@ -0,0 +1,123 @@
+import os
+import numpy as np
+from typing import Dict, Tuple, TYPE_CHECKING
+from numpy.typing import NDArray
+from Lib.IntegralImage import box_filter, scaled_window_means
+from Lib.Instrumentation import stats
+
+# PIL wird erst beim ersten Dekodieren geladen - wer nur aus FrameCube oder Stationsspeicher liest, braucht es nicht
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+# Verkleinerungsfaktoren, die der JPEG-Decoder direkt beim Dekodieren anwenden kann
+DRAFT_SCALES = (1, 2, 4, 8)
+
+
+def image_size(filename: str) -> Tuple[int, int]:
+    """
+    Breite und Höhe eines Bildes, nur aus dem Dateikopf gelesen - die Pixel werden nicht dekodiert
+    """
+    from PIL import Image
+    with Image.open(filename) as img:
+        return img.size
+
+
+def decode_frame(filename: str,
+                 mode: str = "L",
+                 max_row: int | None = None,
+                 scale: int = 1,
+                 gray_direct: bool = True) -> NDArray:
+    """
+    Bild dekodieren und als uint8-Array im gewünschten Modus liefern ("L" = Graustufen)
+
+    Bei JPEGs im Modus "L" liefert der Decoder mit gray_direct direkt die Luminanz, ohne erst RGB zu erzeugen und
+    umzurechnen (Abweichung zur Umrechnung siehe compare_decode(...)). Mit max_row werden nur die Zeilen
+    [0, max_row) dekodiert, das Ergebnis hat dann nur so viele Zeilen. Mit scale = 2, 4 oder 8 verkleinert der
+    Decoder das Bild schon beim Dekodieren um diesen Faktor, max_row bezieht sich dann auf das verkleinerte Bild.
+    Andere Formate werden vollständig dekodiert und danach zugeschnitten.
+    """
+    if scale not in DRAFT_SCALES:
+        raise ValueError(f"The decode scale must be one of {DRAFT_SCALES}: {scale}")
+    from PIL import Image
+    if stats.enabled:
+        stats.count("frames_decoded")
+        stats.count("bytes_read", os.path.getsize(filename))
+    with stats.timer("decode", 1), Image.open(filename) as img:
+        if img.format == "JPEG" and (gray_direct and mode == "L" or scale > 1):
+            width, height = img.size
+            img.draft(mode if gray_direct else img.mode, (width // scale, height // scale))
+        elif scale > 1:
+            raise ValueError(f"Only JPEG images can be decoded with a reduced scale: {filename}")
+        if max_row is not None and max_row < img.size[1] and img.format == "JPEG" and len(img.tile) == 1:
+            img_arr = _decode_rows(img, max(max_row, 0))
+        else:
+            img_arr = np.array(img)
+            if max_row is not None:
+                img_arr = img_arr[:max(max_row, 0)]
+        if img_arr.ndim == 2 and mode == "L" or img_arr.ndim == 3 and mode == "RGB" and img_arr.shape[2] == 3:
+            return img_arr
+        return np.array(Image.fromarray(img_arr).convert(mode))
+
+
+def _decode_rows(img: "Image.Image", num_rows: int) -> NDArray:
+    """
+    Nur die ersten num_rows Zeilen eines JPEGs dekodieren
+
+    JPEGs lassen sich nur von oben nach unten dekodieren, die Zeilen unterhalb werden aber gar nicht erst gelesen.
+    libjpeg meldet das vorzeitige Ende mit einem Fehler, die angeforderten Zeilen sind dann schon vollständig.
+    """
+    from PIL import Image, ImageFile
+    tile = img.tile[0]
+    target = Image.new(img.mode, (img.size[0], num_rows))
+    if num_rows == 0:
+        return np.array(target)
+    decoder = Image._getdecoder(img.mode, tile[0], tile[3], img.decoderconfig)
+    decoder.setimage(target.im, (0, 0, img.size[0], num_rows))
+    img.fp.seek(tile[2])
+    try:
+        while True:
+            data = img.fp.read(ImageFile.SAFEBLOCK)
+            consumed, _ = decoder.decode(data)
+            if consumed < 0:
+                break
+            if not data:
+                raise OSError(f"The image file is truncated: {img.filename}")
+    finally:
+        decoder.cleanup()
+    return np.array(target)
+
+
+def compare_decode(filename: str,
+                   radius: int = 4,
+                   max_row: int | None = None,
+                   scale: int = 1,
+                   gray_direct: bool = True) -> Dict[str, float]:
+    """
+    Genauigkeit einer Dekodierstrategie gegenüber der vollständigen Dekodierung als RGB mit Umrechnung nach "L"
+
+    Verglichen werden die Pixel und die Fenstermittelwerte mit radius an jedem Pixel des vollen Bildes, bei
+    scale > 1 also auch an Pixeln abseits des Rasters des verkleinerten Bildes. Die Fenster auf dem verkleinerten
+    Bild werden wie in SatImgReader.get_cloud_coverage(...) mit scaled_window_means(...) berechnet. Liefert die
+    maximale und mittlere absolute Abweichung in Grauwerten.
+    """
+    reference = decode_frame(filename, max_row=max_row, gray_direct=False)
+    fast = decode_frame(filename, max_row=None if max_row is None else -(-max_row // scale), scale=scale,
+                        gray_direct=gray_direct)
+    ref_means = box_filter(reference, radius)
+    if max_row is not None:
+        # nur Pixel, deren Fenster vollständig in den dekodierten Zeilen liegt
+        ref_means = ref_means[:max(max_row - radius, 0)]
+    if scale > 1:
+        rows, cols = np.indices(ref_means.shape).reshape(2, -1)
+        fast_means = scaled_window_means(fast, rows, cols, radius, scale)[:, 0].reshape(ref_means.shape)
+    else:
+        fast_means = box_filter(fast, radius)[:ref_means.shape[0]]
+    window_diff = np.abs(fast_means - ref_means)
+    result = {"window_max_abs": float(window_diff.max(initial=0)),
+              "window_mean_abs": float(window_diff.mean()) if window_diff.size else 0.0}
+    if scale == 1:
+        pixel_diff = np.abs(fast.astype("int16") - reference)
+        result["pixel_max_abs"] = float(pixel_diff.max(initial=0))
+        result["pixel_mean_abs"] = float(pixel_diff.mean()) if pixel_diff.size else 0.0
+    return result
@@ -0,0 +1,338 @@
+import os
+import re
+import numpy as np
+from datetime import timedelta
+from typing import Dict, List
+from numpy.typing import NDArray, ArrayLike
+
+
+# Zeitliche Auflösung der Satellitenbilder
+SLOT_MINUTES: int = 5
+
+MATCH_SLOT: str = "slot"
+MATCH_EXACT: str = "exact"
+MATCH_ASOF: str = "asof"
+MATCH_NEAREST: str = "nearest"
+MATCH_MODES: List[str] = [MATCH_SLOT, MATCH_EXACT, MATCH_ASOF, MATCH_NEAREST]
+
+# Dateiname des gespeicherten Katalogs im Bildordner und Format der Bildnamen
+CATALOG_FILENAME: str = "sat_catalog.npz"
+CATALOG_VERSION: int = 1
+IMG_NAME_FORMAT: str = "%Y%m%d_%H%M_UTC"
+IMG_SUFFIX: str = ".jpg"
+# IMG_NAME_FORMAT als regulärer Ausdruck, die Gruppen ergeben den Zeitstempel im ISO-Format
+_IMG_NAME_PATTERN = re.compile(r"^(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})_UTC$")
+
+
+def floor_to_slot(times: NDArray) -> NDArray:
+    # Minuten auf den nächsten niedrigeren 5-Minuten-Wert runden
+    return times.astype("datetime64[m]").astype(f"datetime64[{SLOT_MINUTES}m]").astype("datetime64[m]")
+
+
+def _iso_time(file: str) -> str:
+    match = _IMG_NAME_PATTERN.match(os.path.basename(file)[:-len(IMG_SUFFIX)])
+    if match is None:
+        raise ValueError(f"The image name '{file}' does not match the format '{IMG_NAME_FORMAT}{IMG_SUFFIX}'.")
+    return "{}-{}-{}T{}:{}".format(*match.groups())
+
+
+def parse_img_times(files: List[str]) -> NDArray:
+    """
+    Zeitstempel aus den Bildnamen im Format IMG_NAME_FORMAT + IMG_SUFFIX lesen, ohne pandas
+
+    Die Namen werden in ISO-Zeitstempel umgeschrieben und von NumPy in einem Schritt umgewandelt, NumPy prüft dabei
+    auch Monat, Tag und Uhrzeit. Wirft einen ValueError mit dem ersten ungültigen Namen.
+    """
+    iso_times = [_iso_time(file) for file in files]
+    try:
+        return np.array(iso_times, dtype="datetime64[m]")
+    except ValueError:
+        # nur zur Fehlermeldung den ersten ungültigen Zeitstempel suchen
+        for file, iso_time in zip(files, iso_times):
+            try:
+                np.datetime64(iso_time, "m")
+            except ValueError:
+                raise ValueError(f"The image name '{file}' does not match the format "
+                                 f"'{IMG_NAME_FORMAT}{IMG_SUFFIX}'.") from None
+        raise
+
+
+class ImgCatalog:
+    """
+    Nach Zeit sortierter Index der Satellitenbilder
+
+    Die Zuordnung einer Anfrage zu einem Bild erfolgt per Binärsuche (np.searchsorted) für alle Anfragen
+    auf einmal. Bei mehreren Bildern mit gleichem Zeitstempel wird das zuerst eingetragene verwendet.
+
+    Zuordnungsmodi:
+        - "slot": Zeitpunkt auf den 5-Minuten-Takt abrunden, dann exakter Treffer
+        - "exact": exakter Treffer auf die Minute
+        - "asof": letztes Bild zum oder vor dem Zeitpunkt
+        - "nearest": zeitlich nächstes Bild
+    Bei "asof" und "nearest" begrenzt tolerance den erlaubten zeitlichen Abstand.
+
+    Mit scan(...) wird ein Bildordner eingelesen. Neben Zeit und Pfad werden Dateigröße und Änderungszeit jeder
+    Datei sowie die Änderungszeit jedes Ordners gemerkt. Ein erneuter Scan mit dem vorherigen Katalog liest nur
+    Ordner neu ein, deren Änderungszeit sich geändert hat. Mit save(...) und load(...) wird der Katalog als npz
+    gespeichert, sodass ein Programmstart den Bildordner nicht komplett durchsuchen muss.
+    """
+    def __init__(self,
+                 times: ArrayLike,
+                 files: ArrayLike,
+                 sizes: ArrayLike | None = None,
+                 mtimes: ArrayLike | None = None):
+        times = np.asarray(times, dtype="datetime64[m]").reshape(-1)
+        files = np.asarray(files, dtype="str").reshape(-1)
+        sizes = np.zeros(len(files), "int64") if sizes is None else np.asarray(sizes, dtype="int64")
+        mtimes = np.zeros(len(files), "int64") if mtimes is None else np.asarray(mtimes, dtype="int64")
+        if not times.shape == files.shape == sizes.shape == mtimes.shape:
+            raise ValueError(f"The times, files, sizes and mtimes of the ImgCatalog must have the same length: "
+                             f"{times.shape}, {files.shape}, {sizes.shape}, {mtimes.shape}")
+        order = np.argsort(times, kind="stable")
+        self.times: NDArray = times[order]
+        self.files: NDArray = files[order]
+        self.sizes: NDArray = sizes[order]
+        self.mtimes: NDArray = mtimes[order]
+        # Änderungszeiten der eingelesenen Ordner für den inkrementellen Scan, file_dirs verweist für jede
+        # Datei auf ihren Ordner in der Reihenfolge von dir_mtimes
+        self.root: str | None = None
+        self.dir_mtimes: Dict[str, int] = {}
+        self.file_dirs: NDArray = np.full(len(files), -1, dtype="int64")
+        # Sortierreihenfolge der übergebenen Einträge
+        self.order: NDArray = order
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def lookup(self,
+               query_times: ArrayLike,
+               match: str = MATCH_SLOT,
+               tolerance: timedelta | np.timedelta64 | None = None) -> NDArray:
+        """
+        Liefert für jeden Zeitpunkt den Index des passenden Bildes oder -1, wenn es keines gibt
+        """
+        if match not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode '{match}'. Valid modes: {MATCH_MODES}")
+        query_times = np.asarray(query_times, dtype="datetime64[m]").reshape(-1)
+        result = np.full(len(query_times), -1, dtype="int64")
+        num_imgs = len(self.times)
+        if num_imgs == 0:
+            return result
+        valid = ~np.isnat(query_times)
+
+        if match in (MATCH_SLOT, MATCH_EXACT):
+            if match == MATCH_SLOT:
+                query_times = floor_to_slot(query_times)
+            pos = np.searchsorted(self.times, query_times, side="left")
+            hit = valid & (pos < num_imgs)
+            hit[hit] = self.times[pos[hit]] == query_times[hit]
+            result[hit] = pos[hit]
+            return result
+
+        # letztes Bild mit Zeit <= Anfrage
+        before = np.searchsorted(self.times, query_times, side="right") - 1
+        # bei gleichen Zeitstempeln immer den ersten Eintrag nehmen
+        before_first = np.searchsorted(self.times, self.times[np.maximum(before, 0)], side="left")
+        before = np.where(before >= 0, before_first, -1)
+        candidate = before
+        if match == MATCH_NEAREST:
+            after = np.searchsorted(self.times, query_times, side="left")
+            has_after = after < num_imgs
+            dist_before = np.where(before >= 0, query_times - self.times[np.maximum(before, 0)],
+                                   np.timedelta64(np.iinfo("int64").max, "m"))
+            dist_after = np.where(has_after, self.times[np.minimum(after, num_imgs - 1)] - query_times,
+                                  np.timedelta64(np.iinfo("int64").max, "m"))
+            candidate = np.where(dist_after < dist_before, after, before)
+        hit = valid & (candidate >= 0)
+        if tolerance is not None:
+            tolerance = np.timedelta64(tolerance).astype("timedelta64[m]")
+            distance = np.abs(self.times[np.maximum(candidate, 0)] - query_times)
+            hit &= distance <= tolerance
+        result[hit] = candidate[hit]
+        return result
+
+    @classmethod
+    def scan(cls, root: str, previous: "ImgCatalog | None" = None) -> "ImgCatalog":
+        """
+        Bildordner rekursiv nach *.jpg durchsuchen
+
+        Ordner, die schon im vorherigen Katalog mit gleicher Änderungszeit stehen, werden nicht erneut gelesen,
+        ihre Einträge und Unterordner werden übernommen.
+        """
+        root = os.path.abspath(root)
+        if previous is not None and previous.root != root:
+            previous = None
+        prev_by_dir: Dict[str, NDArray] = {}
+        prev_children: Dict[str, List[str]] = {}
+        if previous is not None:
+            prev_dirs = list(previous.dir_mtimes)
+            order = np.argsort(previous.file_dirs, kind="stable")
+            unique_dirs, starts = np.unique(previous.file_dirs[order], return_index=True)
+            for dir_idx, part in zip(unique_dirs, np.split(order, starts[1:])):
+                if dir_idx >= 0:
+                    prev_by_dir[prev_dirs[dir_idx]] = part
+            for a_dir in prev_dirs:
+                if a_dir != root:
+                    prev_children.setdefault(os.path.dirname(a_dir), []).append(a_dir)
+
+        dir_mtimes: Dict[str, int] = {}
+        keep_idx, keep_dirs = [], []
+        new_files, new_sizes, new_mtimes, new_dirs = [], [], [], []
+        stack = [root]
+        while stack:
+            a_dir = stack.pop()
+            try:
+                dir_mtime = os.stat(a_dir).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            dir_mtimes[a_dir] = dir_mtime
+            if previous is not None and previous.dir_mtimes.get(a_dir) == dir_mtime:
+                # Ordner unverändert - Einträge übernehmen
+                if a_dir in prev_by_dir:
+                    keep_idx.append(prev_by_dir[a_dir])
+                    keep_dirs.append(np.full(len(prev_by_dir[a_dir]), len(dir_mtimes) - 1, dtype="int64"))
+                stack.extend(prev_children.get(a_dir, []))
+                continue
+            with os.scandir(a_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.name.endswith(IMG_SUFFIX):
+                        stat = entry.stat()
+                        new_files.append(entry.path)
+                        new_sizes.append(stat.st_size)
+                        new_mtimes.append(stat.st_mtime_ns)
+                        new_dirs.append(len(dir_mtimes) - 1)
+
+        # Zeitstempel aller neuen Dateien auf einmal aus den Dateinamen lesen
+        times = [parse_img_times(new_files)]
+        files = [np.array(new_files, dtype="str")]
+        sizes = [np.array(new_sizes, dtype="int64")]
+        mtimes = [np.array(new_mtimes, dtype="int64")]
+        file_dirs = [np.array(new_dirs, dtype="int64")]
+        if keep_idx:
+            keep = np.concatenate(keep_idx)
+            times.append(previous.times[keep])
+            files.append(previous.files[keep])
+            sizes.append(previous.sizes[keep])
+            mtimes.append(previous.mtimes[keep])
+            file_dirs.append(np.concatenate(keep_dirs))
+        catalog = cls(np.concatenate(times), np.concatenate(files), np.concatenate(sizes), np.concatenate(mtimes))
+        catalog.root = root
+        catalog.dir_mtimes = dir_mtimes
+        catalog.file_dirs = np.concatenate(file_dirs)[catalog.order]
+        return catalog
+
+    def changed_since(self, previous: "ImgCatalog", ignore_dir: str | None = None) -> bool:
+        """
+        Prüft, ob sich Einträge oder Ordner geändert haben. Die Änderungszeit von ignore_dir zählt nicht, damit
+        das Speichern des Katalogs in diesem Ordner nicht bei jedem Start ein erneutes Speichern auslöst.
+        """
+        if len(self) != len(previous) or self.dir_mtimes.keys() != previous.dir_mtimes.keys():
+            return True
+        if any(mtime != previous.dir_mtimes[a_dir] for a_dir, mtime in self.dir_mtimes.items() if a_dir != ignore_dir):
+            return True
+        return not (np.array_equal(self.files, previous.files) and np.array_equal(self.mtimes, previous.mtimes)
+                    and np.array_equal(self.sizes, previous.sizes))
+
+    def refresh(self) -> "ImgCatalog":
+        if self.root is None:
+            raise ValueError("Only a scanned ImgCatalog can be refreshed.")
+        return ImgCatalog.scan(self.root, self)
+
+    def save(self, catalog_file: str):
+        """
+        Katalog als npz speichern, Pfade werden relativ zum Bildordner abgelegt
+
+        Liegt der Katalog in einem der eingelesenen Ordner (z.B. direkt im Bildordner), ändert das Speichern dessen
+        Änderungszeit. Enthält der Ordner danach noch genau die bekannten Bilder und Unterordner, wird die neue
+        Änderungszeit übernommen, damit der nächste Start den Ordner nicht erneut einliest.
+        """
+        if self.root is None:
+            raise ValueError("Only a scanned ImgCatalog can be saved.")
+        tmp_file = f"{catalog_file}.tmp.npz"
+        self._write(tmp_file)
+        # erst nach dem vollständigen Schreiben ersetzen, damit kein halber Katalog entsteht
+        os.replace(tmp_file, catalog_file)
+
+        catalog_dir = os.path.dirname(os.path.abspath(catalog_file))
+        if catalog_dir not in self.dir_mtimes:
+            return
+        # Änderungszeit vor dem Vergleich lesen, spätere Änderungen fallen beim nächsten Start dann noch auf
+        dir_mtime = os.stat(catalog_dir).st_mtime_ns
+        if dir_mtime != self.dir_mtimes[catalog_dir] and self._dir_matches(catalog_dir):
+            self.dir_mtimes[catalog_dir] = dir_mtime
+            # an Ort und Stelle überschreiben legt keinen Ordnereintrag an und lässt die Änderungszeit unverändert
+            self._write(catalog_file)
+
+    def _write(self, target: str):
+        dirs = list(self.dir_mtimes)
+        prefix_len = len(os.path.join(self.root, ""))
+        with open(target, "wb") as npz_file:
+            np.savez(npz_file,
+                     version=np.array(CATALOG_VERSION),
+                     times=self.times.astype("int64"),
+                     files=np.array([file[prefix_len:] for file in self.files], dtype="str"),
+                     sizes=self.sizes,
+                     mtimes=self.mtimes,
+                     file_dirs=self.file_dirs,
+                     dirs=np.array([os.path.relpath(a_dir, self.root) for a_dir in dirs], dtype="str"),
+                     dir_mtimes=np.array([self.dir_mtimes[a_dir] for a_dir in dirs], dtype="int64"))
+
+    def _dir_matches(self, a_dir: str) -> bool:
+        """
+        Prüft, ob der Ordner genau die Bilder und Unterordner enthält, die der Katalog für ihn kennt
+        """
+        dirs = list(self.dir_mtimes)
+        known_files = set(self.files[self.file_dirs == dirs.index(a_dir)].tolist())
+        known_dirs = {child for child in dirs if child != a_dir and os.path.dirname(child) == a_dir}
+        found_files, found_dirs = set(), set()
+        with os.scandir(a_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    found_dirs.add(entry.path)
+                elif entry.name.endswith(IMG_SUFFIX):
+                    found_files.add(entry.path)
+        return found_files == known_files and found_dirs == known_dirs
+
+    @classmethod
+    def load(cls, root: str, catalog_file: str) -> "ImgCatalog | None":
+        """
+        Gespeicherten Katalog laden, liefert None, wenn keiner existiert oder er nicht lesbar ist
+        """
+        root = os.path.abspath(root)
+        try:
+            with np.load(catalog_file, allow_pickle=False) as data:
+                if int(data["version"]) != CATALOG_VERSION:
+                    return None
+                files = np.char.add(os.path.join(root, ""), data["files"]) if len(data["files"]) else data["files"]
+                catalog = cls(data["times"].astype("datetime64[m]"), files, data["sizes"], data["mtimes"])
+                catalog.file_dirs = data["file_dirs"][catalog.order]
+                dirs = [os.path.normpath(os.path.join(root, a_dir)) for a_dir in data["dirs"]]
+                catalog.dir_mtimes = dict(zip(dirs, data["dir_mtimes"].tolist()))
+        except (OSError, KeyError, ValueError):
+            return None
+        catalog.root = root
+        return catalog
+
+
+def load_catalog(root: str,
+                 catalog_file: str | None = None,
+                 persist: bool = True) -> ImgCatalog:
+    """
+    Gespeicherten Katalog laden, inkrementell aktualisieren und bei Änderungen wieder speichern
+
+    Ohne Angabe von catalog_file liegt der Katalog als CATALOG_FILENAME im Bildordner.
+    """
+    if catalog_file is None:
+        catalog_file = os.path.join(root, CATALOG_FILENAME)
+    previous = ImgCatalog.load(root, catalog_file) if persist else None
+    catalog = ImgCatalog.scan(root, previous)
+    catalog_dir = os.path.dirname(os.path.abspath(catalog_file))
+    if persist and (previous is None or catalog.changed_since(previous, catalog_dir)):
+        try:
+            catalog.save(catalog_file)
+        except OSError:
+            # z.B. schreibgeschützter Bildordner - dann eben ohne gespeicherten Katalog
+            pass
+    return catalog
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, List
+
+
+# Umgebungsvariablen zum Einschalten ohne Codeänderung, z.B. SAT_INSTRUMENTATION=1 python Main_...py oder
+# SAT_TRACE=trace.json python Main_...py (schaltet auch den Trace ein, siehe dump_if_enabled())
+ENV_ENABLE: str = "SAT_INSTRUMENTATION"
+ENV_TRACE: str = "SAT_TRACE"
+
+DEFAULT_MAX_EVENTS: int = 1_000_000
+
+
+class _NoTimer:
+    """
+    Timer, der nichts misst - wird bei abgeschalteter Instrumentierung für jede Stufe wiederverwendet
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+class _Timer:
+    __slots__ = ("stats", "stage", "items", "start")
+
+    def __init__(self, stats: "Stats", stage: str, items: int):
+        self.stats = stats
+        self.stage = stage
+        self.items = items
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stats._record(self.stage, self.start, time.perf_counter(), self.items)
+        return False
+
+
+class Stats:
+    """
+    Laufzeiten je Stufe, Zähler und Durchsatz für SatImgReader und die Pipeline-Skripte
+
+    Standardmäßig abgeschaltet: timer(...) liefert dann einen geteilten Timer ohne Messung und count(...) kehrt
+    sofort zurück. Eingeschaltet wird mit enable(...) oder über die Umgebungsvariable ENV_ENABLE. Mit trace werden
+    zusätzlich die einzelnen Messungen (höchstens max_events) festgehalten und lassen sich mit export_trace(...)
+    im Chrome-Trace-Format (chrome://tracing, Perfetto) speichern. Zeiten aus Prozesspools werden nicht erfasst.
+    """
+    def __init__(self, enabled: bool = False, trace: bool = False, max_events: int = DEFAULT_MAX_EVENTS):
+        self.enabled = enabled
+        self.trace = trace
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._stages: Dict[str, List[float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._events: List[tuple] = []
+        self._origin = time.perf_counter()
+
+    def enable(self, trace: bool = False):
+        self.enabled = True
+        self.trace = trace
+
+    def disable(self):
+        self.enabled = False
+        self.trace = False
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._events.clear()
+            self._origin = time.perf_counter()
+
+    def timer(self, stage: str, items: int = 0):
+        """
+        Kontextmanager, der die Laufzeit der Stufe stage misst, items zählt die verarbeiteten Einheiten für den
+        Durchsatz
+        """
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self, stage, items)
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def _record(self, stage: str, start: float, end: float, items: int):
+        duration = end - start
+        with self._lock:
+            # [Aufrufe, Gesamtzeit, längste Zeit, Einheiten]
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = [0, 0.0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+            entry[3] += items
+            if self.trace and len(self._events) < self.max_events:
+                self._events.append((stage, start, duration, threading.get_ident(), items))
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Alle Stufen mit Aufrufen, Zeiten und Durchsatz sowie alle Zähler als verschachteltes Dict
+        """
+        with self._lock:
+            stages = {stage: {"calls": calls,
+                              "total_s": total,
+                              "mean_ms": total / calls * 1000,
+                              "max_ms": longest * 1000,
+                              "items": items,
+                              "items_per_s": items / total if items and total > 0 else None}
+                      for stage, (calls, total, longest, items) in self._stages.items()}
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def report(self) -> str:
+        """
+        Zusammenfassung als lesbare Tabelle, Stufen nach Gesamtzeit sortiert
+        """
+        summary = self.summary()
+        lines = [f"{'stage':<28} {'calls':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10} {'items/s':>12}"]
+        for stage, values in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_s"]):
+            items_per_s = f"{values['items_per_s']:12.0f}" if values["items_per_s"] is not None else f"{'':>12}"
+            lines.append(f"{stage:<28} {values['calls']:>8} {values['total_s']:>10.3f} {values['mean_ms']:>10.3f} "
+                         f"{values['max_ms']:>10.3f} {items_per_s}")
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name:<28} {value:>8}")
+        return "\n".join(lines)
+
+    def export_summary(self, filename: str):
+        with open(filename, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def export_trace(self, filename: str):
+        """
+        Einzelne Messungen im Chrome-Trace-Format speichern, Zeiten in Mikrosekunden seit reset()
+        """
+        with self._lock:
+            events = [{"name": stage, "ph": "X", "ts": (start - self._origin) * 1e6, "dur": duration * 1e6,
+                       "pid": os.getpid(), "tid": thread_id, "args": {"items": items}}
+                      for stage, start, duration, thread_id, items in self._events]
+            counters = dict(self._counters)
+        with open(filename, "w") as file:
+            json.dump({"traceEvents": events, "otherData": {"counters": counters}}, file)
+
+
+# gemeinsame Instanz für alle Module
+stats = Stats(enabled=os.environ.get(ENV_ENABLE, "0") not in ("", "0") or bool(os.environ.get(ENV_TRACE)),
+              trace=bool(os.environ.get(ENV_TRACE)))
+
+
+def dump_if_enabled():
+    """
+    Am Ende eines Skripts: Zusammenfassung ausgeben und, falls ENV_TRACE eine Datei nennt, den Trace speichern
+    """
+    if not stats.enabled:
+        return
+    print(stats.report())
+    trace_file = os.environ.get(ENV_TRACE)
+    if trace_file:
+        stats.export_trace(trace_file)
+        print(f"Trace gespeichert in: {trace_file}")
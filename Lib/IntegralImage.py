@@ -0,0 +1,160 @@
+import numpy as np
+from typing import List, Sequence
+from numpy.typing import NDArray, ArrayLike
+
+
+def as_radii(radius: int | Sequence[int]) -> List[int]:
+    radii = [int(radius)] if np.isscalar(radius) else [int(a_radius) for a_radius in radius]
+    if not radii or min(radii) < 1:
+        raise ValueError(f"Every window radius must be at least 1 pixel: {radius}")
+    return radii
+
+
+def integral_image(img_arr: NDArray) -> NDArray:
+    """
+    Summed-Area-Table der Form (Höhe + 1, Breite + 1) mit einer Nullzeile und Nullspalte am Anfang
+
+    Damit ergibt sich die Summe jedes Rechtecks aus vier Zugriffen, unabhängig von dessen Größe. Ganzzahlige Bilder
+    werden exakt ganzzahlig summiert, alle anderen (z.B. float-Graustufen) als float64.
+    """
+    height, width = img_arr.shape[:2]
+    if not np.issubdtype(img_arr.dtype, np.integer):
+        dtype = "float64"
+    # uint32 reicht, solange 255 * Anzahl Pixel nicht überläuft
+    elif int(img_arr.max(initial=0)) * height * width < 2 ** 32:
+        dtype = "uint32"
+    else:
+        dtype = "int64"
+    sat = np.zeros((height + 1, width + 1), dtype=dtype)
+    np.cumsum(img_arr, axis=0, dtype=dtype, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, dtype=dtype, out=sat[1:, 1:])
+    return sat
+
+
+def _sum_dtype(sat: NDArray) -> str:
+    # Differenzen der Summed-Area-Table ohne Überlauf von uint32 und ohne Abschneiden von float-Summen
+    return "float64" if sat.dtype == np.float64 else "int64"
+
+
+def box_means(sat: NDArray, rows: ArrayLike, cols: ArrayLike, radius: int) -> NDArray:
+    """
+    Mittelwerte der Fenster [row - radius, row + radius) x [col - radius, col + radius) aus der Summed-Area-Table
+
+    Fenster am Bildrand werden auf den Bildbereich beschnitten, Fenster komplett außerhalb des Bildes liefern NaN.
+    """
+    height, width = sat.shape[0] - 1, sat.shape[1] - 1
+    rows = np.asarray(rows, dtype="int64")
+    cols = np.asarray(cols, dtype="int64")
+    r0 = np.clip(rows - radius, 0, height)
+    r1 = np.clip(rows + radius, 0, height)
+    c0 = np.clip(cols - radius, 0, width)
+    c1 = np.clip(cols + radius, 0, width)
+    sums = (sat[r1, c1].astype(_sum_dtype(sat)) - sat[r0, c1] - sat[r1, c0] + sat[r0, c0]).astype("float64")
+    counts = (r1 - r0) * (c1 - c0)
+    means = np.full(rows.shape, np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means
+
+
+def gather_window_means(img_arr: NDArray, rows: ArrayLike, cols: ArrayLike, radius: int) -> NDArray:
+    """
+    Gleiche Fenster wie box_means(...), aber direkt mit einer einzigen Indexoperation aus dem Bild gelesen
+
+    Lohnt sich gegenüber der Summed-Area-Table nur für wenige Punkte.
+    """
+    height, width = img_arr.shape[:2]
+    rows = np.asarray(rows, dtype="int64")
+    cols = np.asarray(cols, dtype="int64")
+    offsets = np.arange(-radius, radius)
+    win_rows = rows[:, None, None] + offsets[None, :, None]
+    win_cols = cols[:, None, None] + offsets[None, None, :]
+    valid = (win_rows >= 0) & (win_rows < height) & (win_cols >= 0) & (win_cols < width)
+    values = img_arr[np.clip(win_rows, 0, height - 1), np.clip(win_cols, 0, width - 1)]
+    sums = np.where(valid, values, 0).sum(axis=(1, 2), dtype="float64")
+    counts = valid.sum(axis=(1, 2))
+    means = np.full(len(rows), np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means
+
+
+def window_means(img_arr: NDArray, rows: ArrayLike, cols: ArrayLike, radius: int | Sequence[int]) -> NDArray:
+    """
+    Fenstermittelwerte für alle Punkte und alle Radien, Ergebnis der Form (Anzahl Punkte, Anzahl Radien)
+
+    Je nach Aufwand wird direkt aus dem Bild gelesen oder einmal die Summed-Area-Table des Bildes berechnet,
+    die dann jeden Radius in O(1) pro Punkt beantwortet.
+    """
+    radii = as_radii(radius)
+    rows = np.asarray(rows, dtype="int64").reshape(-1)
+    cols = np.asarray(cols, dtype="int64").reshape(-1)
+    gather_cost = len(rows) * sum((2 * a_radius) ** 2 for a_radius in radii)
+    if gather_cost < img_arr.shape[0] * img_arr.shape[1]:
+        return np.stack([gather_window_means(img_arr, rows, cols, a_radius) for a_radius in radii], axis=1)
+    sat = integral_image(img_arr)
+    return np.stack([box_means(sat, rows, cols, a_radius) for a_radius in radii], axis=1)
+
+
+def _interpolate_sat(sat: NDArray, rows: NDArray, cols: NDArray) -> NDArray:
+    # Summed-Area-Table an gebrochenen Koordinaten: für ein Bild aus konstanten Pixeln ist sie innerhalb jedes Pixels
+    # bilinear, die Interpolation liefert also die exakte Summe über beliebige Teile von Pixeln
+    height, width = sat.shape[0] - 1, sat.shape[1] - 1
+    rows = np.clip(rows, 0, height)
+    cols = np.clip(cols, 0, width)
+    r0 = np.minimum(rows.astype("int64"), max(height - 1, 0))
+    c0 = np.minimum(cols.astype("int64"), max(width - 1, 0))
+    r1, c1 = np.minimum(r0 + 1, height), np.minimum(c0 + 1, width)
+    fr, fc = rows - r0, cols - c0
+    return ((sat[r0, c0] * (1 - fc) + sat[r0, c1] * fc) * (1 - fr)
+            + (sat[r1, c0] * (1 - fc) + sat[r1, c1] * fc) * fr)
+
+
+def scaled_window_means(img_arr: NDArray,
+                        rows: ArrayLike,
+                        cols: ArrayLike,
+                        radius: int | Sequence[int],
+                        scale: int) -> NDArray:
+    """
+    Fenstermittelwerte wie window_means(...) für Pixel des vollen Bildes, aber aus dem um scale verkleinerten Bild
+
+    Das Fenster [row - radius, row + radius) x [col - radius, col + radius) wird durch scale geteilt und nicht auf
+    das Raster des verkleinerten Bildes gerundet, angeschnittene Pixel zählen anteilig. Es liegt so an derselben
+    Stelle wie im vollen Bild, die Abweichung kommt nur vom Verlust an Details durch das Verkleinern.
+    """
+    radii = as_radii(radius)
+    rows = np.asarray(rows, dtype="float64").reshape(-1)
+    cols = np.asarray(cols, dtype="float64").reshape(-1)
+    sat = integral_image(img_arr).astype("float64")
+    height, width = sat.shape[0] - 1, sat.shape[1] - 1
+    means = np.full((len(rows), len(radii)), np.nan)
+    for radius_idx, a_radius in enumerate(radii):
+        r0 = np.clip((rows - a_radius) / scale, 0, height)
+        r1 = np.clip((rows + a_radius) / scale, 0, height)
+        c0 = np.clip((cols - a_radius) / scale, 0, width)
+        c1 = np.clip((cols + a_radius) / scale, 0, width)
+        sums = (_interpolate_sat(sat, r1, c1) - _interpolate_sat(sat, r0, c1) - _interpolate_sat(sat, r1, c0)
+                + _interpolate_sat(sat, r0, c0))
+        areas = (r1 - r0) * (c1 - c0)
+        np.divide(sums, areas, out=means[:, radius_idx], where=areas > 0)
+    return means
+
+
+def box_filter(img_arr: NDArray, radius: int, step: int = 1) -> NDArray:
+    """
+    Fenstermittelwert für jeden step-ten Pixel des Bildes in einem Durchgang über die Summed-Area-Table
+
+    Liefert ein float32-Array der Form (ceil(Höhe / step), ceil(Breite / step)), das Fenster um den Pixel (y, x) ist
+    wie bei box_means(...) [y - radius, y + radius) x [x - radius, x + radius), am Bildrand beschnitten.
+    """
+    radius = as_radii(radius)[0]
+    if step < 1:
+        raise ValueError(f"The step of the box filter must be at least 1 pixel: {step}")
+    height, width = img_arr.shape[:2]
+    sat = integral_image(img_arr)
+    sat = sat.astype(_sum_dtype(sat))
+    rows = np.arange(0, height, step)
+    cols = np.arange(0, width, step)
+    r0, r1 = np.clip(rows - radius, 0, height), np.clip(rows + radius, 0, height)
+    c0, c1 = np.clip(cols - radius, 0, width), np.clip(cols + radius, 0, width)
+    sums = sat[np.ix_(r1, c1)] - sat[np.ix_(r0, c1)] - sat[np.ix_(r1, c0)] + sat[np.ix_(r0, c0)]
+    counts = np.outer(r1 - r0, c1 - c0)
+    return (sums / counts).astype("float32")
@@ -0,0 +1,78 @@
+import numpy as np
+from typing import Tuple
+from numpy.typing import NDArray, ArrayLike
+
+
+# Pixelkoordinate für ungültige Eingaben (NaN, inf): so weit außerhalb jedes Bildes, dass auch beschnittene Fenster
+# das Bild nicht erreichen und dafür NaN liefern
+INVALID_PIXEL: int = -2 ** 24
+
+
+def _mercator_y(lat: ArrayLike) -> NDArray:
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+class MercatorProjection:
+    """
+    Mercator-Projektion für einen bestimmten Bereich
+
+    Wird die Breite und Höhe der Karte (width und height) genutzt, um die Koordinaten zu skalieren,
+    entfällt die Notwendigkeit der expliziten Berücksichtigung des Erdradius. Die Koordinaten werden
+    innerhalb der gegebenen Grenzen (min_lon, max_lon, min_lat, max_lat) auf die Dimensionen der
+    Karte abgebildet. Das bedeutet, dass der Erdradius implizit durch die Dimensionen und die Skalierung der
+    Karte berücksichtigt wird.
+
+    Die Grenzterme der Projektion werden einmalig berechnet, alle Umrechnungen arbeiten auf ganzen Arrays.
+    """
+    def __init__(self,
+                 min_lat: float,
+                 max_lat: float,
+                 min_lon: float,
+                 max_lon: float,
+                 img_width: int,
+                 img_height: int):
+        if min_lat == max_lat or min_lon == max_lon:
+            raise ValueError(f"The bounds of the MercatorProjection must span an area: "
+                             f"lat {(min_lat, max_lat)}, lon {(min_lon, max_lon)}")
+        self.min_lat = min_lat
+        self.max_lat = max_lat
+        self.min_lon = min_lon
+        self.max_lon = max_lon
+        self.img_width = img_width
+        self.img_height = img_height
+        self._merc_min = float(_mercator_y(min_lat))
+        self._merc_span = float(_mercator_y(max_lat)) - self._merc_min
+        self._lon_span = max_lon - min_lon
+
+    def latlon_to_pixel_float(self, lat: ArrayLike, lon: ArrayLike) -> Tuple[NDArray, NDArray]:
+        # Berechne die x-Koordinate (Longitude)
+        pix_x = (np.asarray(lon, dtype="float64") - self.min_lon) / self._lon_span * self.img_width
+        # Berechne die y-Koordinate (Latitude) unter Verwendung der Mercator-Projektion
+        pix_y = (_mercator_y(np.asarray(lat, dtype="float64")) - self._merc_min) / self._merc_span * self.img_height
+        # Pixelkoordinaten umdrehen, da y in Bildern von oben nach unten geht
+        return pix_x, self.img_height - pix_y
+
+    def latlon_to_pixel(self, lat: ArrayLike, lon: ArrayLike) -> Tuple[NDArray, NDArray]:
+        """
+        Liefert die ganzzahligen Pixelkoordinaten (x = Spalte, y = Zeile) als int64-Arrays
+
+        Wie bei int(...) wird Richtung 0 abgeschnitten. Ungültige Eingaben (NaN, inf) ergeben die Koordinate
+        INVALID_PIXEL, mit valid_mask(...) lassen sich diese und Punkte außerhalb des Bildes erkennen.
+        """
+        pix_x, pix_y = self.latlon_to_pixel_float(lat, lon)
+        finite = np.isfinite(pix_x) & np.isfinite(pix_y)
+        pix_x = np.where(finite, np.trunc(pix_x), INVALID_PIXEL).astype("int64")
+        pix_y = np.where(finite, np.trunc(pix_y), INVALID_PIXEL).astype("int64")
+        return pix_x, pix_y
+
+    def valid_mask(self, pix_x: NDArray, pix_y: NDArray) -> NDArray:
+        return (pix_x >= 0) & (pix_x < self.img_width) & (pix_y >= 0) & (pix_y < self.img_height)
+
+    def pixel_to_latlon(self, pix_x: ArrayLike, pix_y: ArrayLike) -> Tuple[NDArray, NDArray]:
+        """
+        Umkehrung von latlon_to_pixel_float(...), liefert (lat, lon)
+        """
+        lon = np.asarray(pix_x, dtype="float64") / self.img_width * self._lon_span + self.min_lon
+        merc = (self.img_height - np.asarray(pix_y, dtype="float64")) / self.img_height * self._merc_span
+        lat = np.degrees(2 * np.arctan(np.exp(merc + self._merc_min)) - np.pi / 2)
+        return lat, lon
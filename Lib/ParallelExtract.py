@@ -0,0 +1,123 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Sequence, Tuple
+from numpy.typing import NDArray, ArrayLike
+from Lib.FrameCube import FrameCube
+from Lib.FrameDecoder import decode_frame
+from Lib.IntegralImage import as_radii, window_means
+
+
+# Zustand eines Worker-Prozesses, wird einmal pro Prozess im Initializer gesetzt
+_worker: dict = {}
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _init_worker(shm_name: str,
+                 shape: Tuple[int, int],
+                 pix_x: NDArray,
+                 pix_y: NDArray,
+                 point_order: NDArray,
+                 out_order: NDArray | None,
+                 radii: List[int],
+                 cube_dir: str | None):
+    # Freigegeben wird der Speicher nur vom Hauptprozess
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker.update(
+        shm=shm,
+        result=np.ndarray(shape, dtype="float64", buffer=shm.buf),
+        pix_x=pix_x,
+        pix_y=pix_y,
+        point_order=point_order,
+        out_order=out_order,
+        radii=radii,
+        cube=FrameCube(cube_dir) if cube_dir is not None else None
+    )
+
+
+def _run_task(source: str | int, start: int, end: int, out_offset: int):
+    """
+    Fenstermittelwerte der Punkte point_order[start:end] in einem Bild berechnen und in die Ergebnismatrix schreiben
+
+    source ist ein Dateiname (JPEG) oder der Index eines Bildes im FrameCube. Die Ergebniszeilen sind
+    out_offset + 0..n oder, bei out_offset < 0, out_order[start:end].
+    """
+    img_arr = _worker["cube"].frame(source) if isinstance(source, int) else decode_frame(source)
+    points = _worker["point_order"][start:end]
+    means = window_means(img_arr, _worker["pix_y"][points], _worker["pix_x"][points], _worker["radii"])
+    if out_offset >= 0:
+        _worker["result"][out_offset:out_offset + len(points)] = means
+    else:
+        _worker["result"][_worker["out_order"][start:end]] = means
+
+
+def _run_tasks(tasks: Sequence[Tuple[str | int, int, int, int]],
+               num_rows: int,
+               pix_x: NDArray,
+               pix_y: NDArray,
+               point_order: NDArray,
+               out_order: NDArray | None,
+               radii: List[int],
+               workers: int,
+               cube_dir: str | None) -> NDArray:
+    shape = (num_rows, len(radii))
+    shm = shared_memory.SharedMemory(create=True, size=max(num_rows * len(radii) * 8, 1))
+    try:
+        result = np.ndarray(shape, dtype="float64", buffer=shm.buf)
+        result[:] = np.nan
+        initargs = (shm.name, shape, pix_x, pix_y, point_order, out_order, radii, cube_dir)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+            # Fehler der Worker hier weiterreichen
+            for future in [pool.submit(_run_task, *task) for task in tasks]:
+                future.result()
+        return result.copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def parallel_group_means(sources: Sequence[str | int],
+                         groups: Sequence[NDArray],
+                         num_rows: int,
+                         pix_x: NDArray,
+                         pix_y: NDArray,
+                         radius: int | Sequence[int],
+                         workers: int | None = None,
+                         cube_dir: str | None = None) -> NDArray:
+    """
+    Fenstermittelwerte für Anfragen, die nach Bildern gruppiert sind, verteilt auf einen Prozesspool
+
+    groups[i] enthält die Anfragezeilen, die im Bild sources[i] liegen. pix_x/pix_y gelten für alle num_rows Zeilen.
+    Liefert die Matrix (num_rows, Anzahl Radien), Zeilen ohne Bild bleiben NaN.
+    """
+    radii = as_radii(radius)
+    point_order = np.concatenate(groups) if len(groups) else np.empty(0, dtype="int64")
+    bounds = np.cumsum([0] + [len(group) for group in groups])
+    tasks = [(source, int(bounds[pos]), int(bounds[pos + 1]), -1) for pos, source in enumerate(sources)]
+    return _run_tasks(tasks, num_rows, pix_x, pix_y, point_order, point_order, radii,
+                      workers or default_workers(), cube_dir)
+
+
+def parallel_frame_means(sources: Sequence[str | int],
+                         pix_x: ArrayLike,
+                         pix_y: ArrayLike,
+                         radius: int | Sequence[int],
+                         workers: int | None = None,
+                         cube_dir: str | None = None) -> NDArray:
+    """
+    Fenstermittelwerte aller Punkte in jedem Bild, verteilt auf einen Prozesspool
+
+    Liefert ein Array der Form (Anzahl Bilder, Anzahl Punkte, Anzahl Radien).
+    """
+    radii = as_radii(radius)
+    pix_x = np.asarray(pix_x, dtype="int64").reshape(-1)
+    pix_y = np.asarray(pix_y, dtype="int64").reshape(-1)
+    num_points = len(pix_x)
+    tasks = [(source, 0, num_points, pos * num_points) for pos, source in enumerate(sources)]
+    result = _run_tasks(tasks, len(sources) * num_points, pix_x, pix_y, np.arange(num_points), None, radii,
+                        workers or default_workers(), cube_dir)
+    return result.reshape(len(sources), num_points, len(radii))
@@ -0,0 +1,213 @@
+import os
+import json
+import numpy as np
+from typing import Callable, List
+from numpy.typing import NDArray, ArrayLike
+from Lib.MercatorProjection import MercatorProjection
+
+
+STORE_VERSION: int = 1
+
+# Speicherformat der Grauwerte: float32 oder auf ganze Grauwerte gerundet als uint8 (ein Viertel des Platzes)
+ENCODING_FLOAT32: str = "float32"
+ENCODING_UINT8: str = "uint8"
+ENCODINGS: List[str] = [ENCODING_FLOAT32, ENCODING_UINT8]
+# Kennung für fehlende Grauwerte im uint8-Format, echte Grauwerte werden dafür auf 254 begrenzt
+GRAY_UINT8_NODATA: int = 255
+
+
+class StationStore:
+    """
+    Gespeicherte Matrizen (Zeitpunkt x Station) der mittleren Grauwerte und der Referenzwerte fester Stationen
+
+    Jede Zeile gehört zu einem Bild und ist über dessen Zeitstempel und Änderungszeit verschlüsselt. Der ganze
+    Speicher gilt nur für genau eine Stationsliste, einen Fensterradius und eine Bildgeometrie - passt eines davon
+    nicht, wird er verworfen. Bei update_gray(...) werden nur Zeilen neuer oder geänderter Bilder berechnet, bei
+    update_ref(...) nur fehlende Referenzwerte nachgeladen.
+
+    Die Grauwerte werden im Format encoding abgelegt, gray_values(...) liefert sie immer als float64 mit NaN.
+    Ohne with_ref wird keine Referenzmatrix geführt.
+    """
+    def __init__(self,
+                 lats: ArrayLike,
+                 lons: ArrayLike,
+                 radius: int,
+                 projection: MercatorProjection,
+                 encoding: str = ENCODING_FLOAT32,
+                 with_ref: bool = True):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}', expected one of: {ENCODINGS}")
+        self.lats: NDArray = np.asarray(lats, dtype="float64").reshape(-1)
+        self.lons: NDArray = np.asarray(lons, dtype="float64").reshape(-1)
+        if self.lats.shape != self.lons.shape:
+            raise ValueError(f"The latitudes and longitudes must have the same length: "
+                             f"{self.lats.shape} != {self.lons.shape}")
+        self.radius = int(radius)
+        self.encoding = encoding
+        self.with_ref = with_ref
+        self.geometry: NDArray = np.array([projection.min_lat, projection.max_lat, projection.min_lon,
+                                           projection.max_lon, projection.img_width, projection.img_height],
+                                          dtype="float64")
+        self.times: NDArray = np.empty(0, dtype="datetime64[m]")
+        self.mtimes: NDArray = np.empty(0, dtype="int64")
+        self.gray: NDArray = np.empty((0, self.num_stations), dtype=encoding)
+        self.ref: NDArray | None = np.empty((0, self.num_stations), dtype="float32") if with_ref else None
+        # Zeilen, deren Referenzwerte schon abgefragt wurden, und Kennung des Stands der Referenzdaten
+        self.ref_checked: NDArray = np.empty(0, dtype=bool)
+        self.ref_key: str = ""
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def num_stations(self) -> int:
+        return len(self.lats)
+
+    def encode_gray(self, values: ArrayLike) -> NDArray:
+        values = np.asarray(values, dtype="float64")
+        if self.encoding == ENCODING_FLOAT32:
+            return values.astype("float32")
+        encoded = np.clip(np.round(np.nan_to_num(values)), 0, GRAY_UINT8_NODATA - 1).astype("uint8")
+        encoded[np.isnan(values)] = GRAY_UINT8_NODATA
+        return encoded
+
+    def decode_gray(self, encoded: NDArray) -> NDArray:
+        values = encoded.astype("float64")
+        if self.encoding == ENCODING_UINT8:
+            values[encoded == GRAY_UINT8_NODATA] = np.nan
+        return values
+
+    def gray_values(self, rows: ArrayLike | None = None, stations: ArrayLike | None = None) -> NDArray:
+        """
+        Grauwerte als float64, ohne rows und stations die ganze Matrix, sonst die Werte der Paare (rows, stations)
+        """
+        if rows is None and stations is None:
+            return self.decode_gray(self.gray)
+        return self.decode_gray(self.gray[np.asarray(rows, dtype="int64"), np.asarray(stations, dtype="int64")])
+
+    def _same_key(self, lats: NDArray, lons: NDArray, radius: int, geometry: NDArray) -> bool:
+        return (radius == self.radius and np.array_equal(geometry, self.geometry)
+                and np.array_equal(lats, self.lats) and np.array_equal(lons, self.lons))
+
+    def update_gray(self,
+                    times: ArrayLike,
+                    mtimes: ArrayLike,
+                    extract: Callable[[NDArray], NDArray]) -> bool:
+        """
+        Zeilen an die Bilder (times, mtimes) anpassen, in deren Reihenfolge
+
+        Zeilen von Bildern, die es nicht mehr gibt, fallen weg. Für neue oder geänderte Bilder wird
+        extract(Positionen) aufgerufen, das die Grauwerte der Form (Anzahl Positionen, Anzahl Stationen) liefert.
+        Gibt zurück, ob sich etwas geändert hat.
+        """
+        times = np.asarray(times, dtype="datetime64[m]").reshape(-1)
+        mtimes = np.asarray(mtimes, dtype="int64").reshape(-1)
+        old_rows = {key: row for row, key in enumerate(zip(self.times.astype("int64").tolist(),
+                                                           self.mtimes.tolist()))}
+        rows = np.array([old_rows.get(key, -1) for key in zip(times.astype("int64").tolist(), mtimes.tolist())],
+                        dtype="int64")
+        kept = rows >= 0
+        missing = np.flatnonzero(~kept)
+        if len(missing) == 0 and len(rows) == len(self.times) and np.array_equal(rows, np.arange(len(rows))):
+            return False
+
+        gray = np.empty((len(times), self.num_stations), dtype=self.gray.dtype)
+        gray[kept] = self.gray[rows[kept]]
+        ref = None
+        if self.with_ref:
+            ref = np.full((len(times), self.num_stations), np.nan, dtype="float32")
+            ref[kept] = self.ref[rows[kept]]
+        ref_checked = np.zeros(len(times), dtype=bool)
+        ref_checked[kept] = self.ref_checked[rows[kept]]
+        if len(missing) > 0:
+            values = np.asarray(extract(missing))
+            if values.shape != (len(missing), self.num_stations):
+                raise ValueError(f"Expected gray values of the shape {(len(missing), self.num_stations)}, "
+                                 f"got {values.shape}")
+            gray[missing] = self.encode_gray(values)
+        self.times, self.mtimes = times, mtimes
+        self.gray, self.ref, self.ref_checked = gray, ref, ref_checked
+        return True
+
+    def update_ref(self,
+                   fetch: Callable[[NDArray, int], NDArray],
+                   ref_key: str = "") -> bool:
+        """
+        Fehlende Referenzwerte mit fetch(Zeitpunkte, Station) nachladen, das je Zeitpunkt einen Wert (oder NaN) liefert
+
+        Abgefragt werden die NaN-Werte neuer Zeilen. Hat sich ref_key geändert (z.B. neue Stationsdaten), werden
+        alle NaN-Werte erneut abgefragt, vorhandene Werte bleiben. Gibt zurück, ob sich etwas geändert hat.
+        """
+        if not self.with_ref:
+            raise ValueError("This StationStore was created without reference values.")
+        rows = np.arange(len(self)) if ref_key != self.ref_key else np.flatnonzero(~self.ref_checked)
+        changed = ref_key != self.ref_key or len(rows) > 0
+        for station in range(self.num_stations):
+            station_rows = rows[np.isnan(self.ref[rows, station])]
+            if len(station_rows) > 0:
+                self.ref[station_rows, station] = np.asarray(fetch(self.times[station_rows], station),
+                                                             dtype="float32")
+        self.ref_checked[:] = True
+        self.ref_key = ref_key
+        return changed
+
+    def save(self, store_file: str):
+        os.makedirs(os.path.dirname(os.path.abspath(store_file)), exist_ok=True)
+        tmp_file = f"{store_file}.tmp.npz"
+        ref = {"ref": self.ref} if self.with_ref else {}
+        np.savez(tmp_file,
+                 version=np.array(STORE_VERSION),
+                 lats=self.lats,
+                 lons=self.lons,
+                 radius=np.array(self.radius),
+                 geometry=self.geometry,
+                 encoding=np.array(self.encoding),
+                 times=self.times.astype("int64"),
+                 mtimes=self.mtimes,
+                 gray=self.gray,
+                 ref_checked=self.ref_checked,
+                 ref_key=np.array(json.dumps(self.ref_key)),
+                 **ref)
+        # erst nach dem vollständigen Schreiben ersetzen, damit kein halber Speicher entsteht
+        os.replace(tmp_file, store_file)
+
+    @classmethod
+    def load(cls,
+             store_file: str,
+             lats: ArrayLike,
+             lons: ArrayLike,
+             radius: int,
+             projection: MercatorProjection,
+             encoding: str = ENCODING_FLOAT32,
+             with_ref: bool = True) -> "StationStore":
+        """
+        Gespeicherte Matrizen laden, liefert einen leeren Speicher, wenn keiner existiert, er nicht lesbar ist oder
+        für andere Stationen, einen anderen Radius oder eine andere Bildgeometrie angelegt wurde
+
+        Gespeicherte Grauwerte in einem anderen Format werden umgewandelt. Fehlen die Referenzwerte, werden sie
+        beim nächsten update_ref(...) für alle Zeilen abgefragt.
+        """
+        store = cls(lats, lons, radius, projection, encoding, with_ref)
+        try:
+            with np.load(store_file, allow_pickle=False) as data:
+                if int(data["version"]) != STORE_VERSION or not store._same_key(data["lats"], data["lons"],
+                                                                                int(data["radius"]),
+                                                                                data["geometry"]):
+                    return store
+                store.times = data["times"].astype("datetime64[m]")
+                store.mtimes = data["mtimes"]
+                stored = cls(lats, lons, radius, projection, str(data["encoding"]), with_ref)
+                store.gray = store.encode_gray(stored.decode_gray(data["gray"])) \
+                    if stored.encoding != encoding else data["gray"]
+                if with_ref and "ref" in data.files:
+                    store.ref = data["ref"]
+                    store.ref_checked = data["ref_checked"]
+                    store.ref_key = json.loads(str(data["ref_key"]))
+                elif with_ref:
+                    store.ref = np.full(store.gray.shape, np.nan, dtype="float32")
+                    store.ref_checked = np.zeros(len(store.times), dtype=bool)
+                else:
+                    store.ref_checked = np.zeros(len(store.times), dtype=bool)
+        except (OSError, KeyError, ValueError):
+            return cls(lats, lons, radius, projection, encoding, with_ref)
+        return store
@@ -0,0 +1,157 @@
+import os
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from typing import Dict, Iterator, List, Tuple
+from numpy.typing import NDArray
+from Lib.ImgCatalog import IMG_NAME_FORMAT, IMG_SUFFIX, SLOT_MINUTES
+from Lib.TileDownloader import GERMANY_TILES_X, GERMANY_TILES_Y
+from Lib.SatImgReader import MIN_LAT_GER, MAX_LAT_GER, MIN_LON_GER, MAX_LON_GER
+
+
+# Kachelgröße des Satelliten-Viewers, ein Mosaik für Deutschland hat 2 x 3 Kacheln, also 512 x 768 Pixel
+TILE_SIZE: int = 256
+MOSAIC_WIDTH: int = len(GERMANY_TILES_X) * TILE_SIZE
+MOSAIC_HEIGHT: int = len(GERMANY_TILES_Y) * TILE_SIZE
+
+
+class SyntheticClouds:
+    """
+    Erzeugt eine Folge künstlicher Satellitenbilder mit ziehenden Wolkenfeldern
+
+    Ein großes, glattes Zufallsfeld wird mit konstanter Geschwindigkeit über einen dunklen Untergrund geschoben.
+    So ähneln sich aufeinanderfolgende Bilder wie echte 5-Minuten-Aufnahmen, und JPEG-Größe und Dekodierzeit
+    liegen in der Größenordnung der echten Mosaike.
+    """
+    def __init__(self,
+                 width: int = MOSAIC_WIDTH,
+                 height: int = MOSAIC_HEIGHT,
+                 seed: int = 0,
+                 drift: Tuple[int, int] = (3, 1)):
+        self.width = width
+        self.height = height
+        self.drift = drift
+        rng = np.random.default_rng(seed)
+        # grobes Zufallsfeld hochskalieren, ergibt zusammenhängende Wolken
+        field_size = (2 * width, 2 * height)
+        coarse = Image.fromarray((rng.random((field_size[1] // 32, field_size[0] // 32)) * 255).astype("uint8"))
+        clouds = np.asarray(coarse.resize(field_size, Image.BICUBIC), dtype="float32")
+        self._clouds = np.clip((clouds - 90) * 1.6, 0, 255)
+        detail = rng.normal(0, 12, (height, width)).astype("float32")
+        land = np.asarray(Image.fromarray((rng.random((height // 16, width // 16)) * 60 + 30).astype("uint8"))
+                          .resize((width, height), Image.BILINEAR), dtype="float32")
+        self._ground = land + detail
+
+    def frame(self, frame_idx: int) -> NDArray:
+        """
+        RGB-Bild (Höhe, Breite, 3) als uint8 zum Zeitschritt frame_idx
+        """
+        dx = (frame_idx * self.drift[0]) % self.width
+        dy = (frame_idx * self.drift[1]) % self.height
+        clouds = self._clouds[dy:dy + self.height, dx:dx + self.width]
+        gray = np.maximum(self._ground, clouds)
+        # Wolken weiß, Land leicht grünlich, Wasser etwas blauer
+        rgb = np.stack([gray * 0.95, gray, np.maximum(gray, self._ground * 1.1)], axis=-1)
+        return np.clip(rgb, 0, 255).astype("uint8")
+
+    def jpeg(self, frame_idx: int, quality: int = 85) -> bytes:
+        buffer = BytesIO()
+        Image.fromarray(self.frame(frame_idx)).save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+
+    def tiles(self, frame_idx: int, quality: int = 85) -> Dict[Tuple[int, int], bytes]:
+        """
+        Das Bild als JPEG-Kacheln, wie sie der TileDownloader für Deutschland liefert
+        """
+        rgb = self.frame(frame_idx)
+        tiles = {}
+        for row, y in enumerate(GERMANY_TILES_Y):
+            for col, x in enumerate(GERMANY_TILES_X):
+                buffer = BytesIO()
+                Image.fromarray(rgb[row * TILE_SIZE:(row + 1) * TILE_SIZE, col * TILE_SIZE:(col + 1) * TILE_SIZE])\
+                    .save(buffer, format="JPEG", quality=quality)
+                tiles[(x, y)] = buffer.getvalue()
+        return tiles
+
+
+def synthetic_times(num_frames: int, start: str = "2024-07-24T00:00") -> NDArray:
+    return np.datetime64(start, "m") + np.arange(num_frames) * np.timedelta64(SLOT_MINUTES, "m")
+
+
+def generate_archive(root: str,
+                     num_frames: int,
+                     start: str = "2024-07-24T00:00",
+                     frames_per_dir: int | None = 288,
+                     seed: int = 0,
+                     quality: int = 85) -> NDArray:
+    """
+    Synthetisches Bildarchiv im Format von combined_images anlegen: <root>/<Tag>/<%Y%m%d_%H%M_UTC>.jpg
+
+    Je frames_per_dir Bilder (288 = ein Tag im 5-Minuten-Takt) liegen in einem Unterordner, mit None alle Bilder
+    direkt in root wie bei TileFusion (<root>/<%Y%m%d_%H%M_UTC>.jpg). Vorhandene Bilder werden nicht neu
+    geschrieben. Liefert die Zeitstempel der Bilder.
+    """
+    clouds = SyntheticClouds(seed=seed)
+    times = synthetic_times(num_frames, start)
+    for frame_idx, a_time in enumerate(times.astype("datetime64[s]").tolist()):
+        img_dir = root if frames_per_dir is None else os.path.join(root, f"{frame_idx // frames_per_dir:04d}")
+        img_path = os.path.join(img_dir, a_time.strftime(IMG_NAME_FORMAT) + IMG_SUFFIX)
+        if not os.path.isfile(img_path):
+            os.makedirs(img_dir, exist_ok=True)
+            with open(img_path, "wb") as img_file:
+                img_file.write(clouds.jpeg(frame_idx, quality))
+    return times
+
+
+def synthetic_stations(num_stations: int, seed: int = 0, margin: float = 0.5) -> NDArray:
+    """
+    Zufällige Stationskoordinaten (lat, lon) innerhalb der Grenzen von Deutschland, Form (Anzahl Stationen, 2)
+    """
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(MIN_LAT_GER + margin, MAX_LAT_GER - margin, num_stations)
+    lons = rng.uniform(MIN_LON_GER + margin, MAX_LON_GER - margin, num_stations)
+    return np.stack([lats, lons], axis=1)
+
+
+def synthetic_reference(gray: NDArray,
+                        threshold: float = 160,
+                        noise_okta: float = 1.0,
+                        missing: float = 0.05,
+                        seed: int = 0) -> NDArray:
+    """
+    Künstliche Referenzbedeckung in % zu mittleren Grauwerten, wie sie eine DWD-Station in Achteln melden würde
+
+    Der Bedeckungsgrad folgt min(gray / threshold, 1), verrauscht mit noise_okta Achteln, gerundet auf ganze Achtel.
+    Der Anteil missing der Werte fehlt (NaN).
+    """
+    rng = np.random.default_rng(seed)
+    okta = np.clip(np.round(np.minimum(gray / threshold, 1) * 8 + rng.normal(0, noise_okta, gray.shape)), 0, 8)
+    ref = okta / 8 * 100
+    ref[rng.random(gray.shape) < missing] = np.nan
+    return ref
+
+
+class SyntheticTileSource:
+    """
+    Liefert Kacheln wie TileDownloader.iter_tiles(...), aber ohne Netzwerk, z.B. für download_and_fuse(...)
+
+    Die Kacheln aller Zeitpunkte werden vorab kodiert, damit eine Zeitmessung nur die Fusion erfasst.
+    """
+    def __init__(self, timestamps: List[int], seed: int = 0, quality: int = 85):
+        clouds = SyntheticClouds(seed=seed)
+        self.records: List[Dict] = []
+        self.mosaics: List[Dict] = []
+        self._tiles = {timestamp: clouds.tiles(frame_idx, quality) for frame_idx, timestamp in enumerate(timestamps)}
+
+    def iter_tiles(self,
+                   timestamps: List[int],
+                   tiles_x: List[int] = GERMANY_TILES_X,
+                   tiles_y: List[int] = GERMANY_TILES_Y) -> Iterator[Tuple[int, int, int, bytes | None]]:
+        for timestamp in timestamps:
+            for y in tiles_y:
+                for x in tiles_x:
+                    yield timestamp, x, y, self._tiles.get(timestamp, {}).get((x, y))
+
+    def record_mosaic(self, timestamp: int, status: str, path: str | None = None, error: str | None = None):
+        self.mosaics.append({"timestamp": timestamp, "status": status, "path": path,
+                             "errors": [] if error is None else [error]})
@@ -0,0 +1,199 @@
+import numpy as np
+from typing import List, Tuple
+from numpy.typing import NDArray, ArrayLike
+from Lib.Instrumentation import stats
+
+
+METRIC_MSE: str = "mse"
+METRIC_MAE: str = "mae"
+METRIC_MODES: List[str] = [METRIC_MSE, METRIC_MAE]
+
+# Gruppierung der Fehlerkurven
+BY_ALL: str = "all"
+BY_STATION: str = "station"
+BY_HOUR: str = "hour"
+BY_MODES: List[str] = [BY_ALL, BY_STATION, BY_HOUR]
+
+DEFAULT_THRESHOLDS: NDArray = np.arange(1, 256, dtype="float64")
+
+
+def _count_thresholds_below(thresholds: NDArray, keys: NDArray) -> NDArray:
+    """
+    Anzahl der sortierten Grenzwerte <= Schlüssel, ab diesem Grenzwert-Index zählt der Eintrag zu "Schlüssel < t"
+    """
+    steps = np.diff(thresholds)
+    if len(steps) == 0 or steps.min() <= 0 or not np.allclose(steps, steps[0]):
+        return np.searchsorted(thresholds, keys, side="right")
+    # gleichmäßiges Raster: Index direkt berechnen statt zu suchen, Rundungsfehler an den Grenzen korrigieren
+    with np.errstate(invalid="ignore"):
+        count = np.clip(np.floor((keys - thresholds[0]) / steps[0]) + 1, 0, len(thresholds)).astype("int64")
+    count += (count < len(thresholds)) & (thresholds[np.minimum(count, len(thresholds) - 1)] <= keys)
+    count -= (count > 0) & (thresholds[np.maximum(count - 1, 0)] > keys)
+    return count
+
+
+class _BinnedSums:
+    """
+    Summen mehrerer Größen je Gruppe über alle Einträge mit Schlüssel < t, für jeden Grenzwert t
+
+    Die Einträge werden per Binärsuche den Intervallen zwischen den sortierten Grenzwerten zugeordnet und je
+    (Gruppe, Intervall) mit np.bincount(...) aufsummiert. Die kumulierte Summe über die Intervalle liefert dann alle
+    Gruppen und Grenzwerte auf einmal, ohne die Einträge selbst zu sortieren.
+    """
+    def __init__(self, groups: NDArray, keys: NDArray, values: List[NDArray], num_groups: int, thresholds: NDArray):
+        num_bins = len(thresholds) + 1
+        bins = groups * num_bins + _count_thresholds_below(thresholds, keys)
+        self.sums = [np.cumsum(np.bincount(bins, weights=value, minlength=num_groups * num_bins)
+                               .reshape(num_groups, num_bins), axis=1) for value in values]
+
+    def below(self) -> List[NDArray]:
+        # Form (Anzahl Gruppen, Anzahl Grenzwerte)
+        return [sums[:, :-1] for sums in self.sums]
+
+    def totals(self) -> List[NDArray]:
+        return [sums[:, -1:] for sums in self.sums]
+
+
+def threshold_errors(gray: ArrayLike,
+                     ref: ArrayLike,
+                     thresholds: ArrayLike = DEFAULT_THRESHOLDS,
+                     metric: str = METRIC_MSE,
+                     groups: ArrayLike | None = None,
+                     num_groups: int | None = None) -> NDArray:
+    """
+    Mittlerer Fehler zwischen min(gray / t, 1) * 100 und ref für jede Gruppe und jeden Grenzwert t
+
+    gray und ref haben die gleiche Form, Paare mit NaN werden ignoriert. groups ordnet jedem Eintrag eine Gruppe
+    0..num_groups - 1 zu, ohne groups ist jede Spalte (Station) eine Gruppe. Die Fehler werden nicht Grenzwert für
+    Grenzwert berechnet, sondern geschlossen aus kumulierten Summen über die Grauwerte:
+
+        MSE: für g < t gilt (100 * g / t - r)^2 = 1e4 * g^2 / t^2 - 200 * g * r / t + r^2, sonst (100 - r)^2
+        MAE: 100 * g / t - r wechselt bei t = 100 * g / r das Vorzeichen, die Paare werden auch danach summiert
+
+    Die Grenzwerte dürfen beliebige positive Zahlen sein, auch nicht ganzzahlige. Liefert ein Array der Form
+    (Anzahl Gruppen, Anzahl Grenzwerte), Gruppen ohne gültige Paare sind NaN.
+    """
+    if metric not in METRIC_MODES:
+        raise ValueError(f"Unknown metric '{metric}', expected one of: {METRIC_MODES}")
+    gray = np.asarray(gray, dtype="float64")
+    ref = np.asarray(ref, dtype="float64")
+    if gray.shape != ref.shape:
+        raise ValueError(f"The gray values and references must have the same shape: {gray.shape} != {ref.shape}")
+    thresholds = np.asarray(thresholds, dtype="float64").reshape(-1)
+    if len(thresholds) == 0 or thresholds.min() <= 0:
+        raise ValueError("The thresholds must be positive.")
+    if groups is None:
+        groups = np.broadcast_to(np.arange(gray.shape[-1] if gray.ndim else 1), gray.shape)
+        num_groups = gray.shape[-1] if gray.ndim else 1
+    groups = np.asarray(groups, dtype="int64")
+    if groups.shape != gray.shape:
+        raise ValueError(f"The groups must have the same shape as the gray values: {groups.shape} != {gray.shape}")
+    if num_groups is None:
+        num_groups = int(groups.max(initial=-1)) + 1
+
+    # intern mit sortierten Grenzwerten rechnen, am Ende in die Reihenfolge des Aufrufers zurück
+    order = np.argsort(thresholds, kind="stable")
+    sorted_thresholds = thresholds[order]
+    valid = ~(np.isnan(gray) | np.isnan(ref))
+    g, r, group = gray[valid], ref[valid], groups[valid]
+    counts = np.bincount(group, minlength=num_groups).astype("float64")[:, None]
+
+    with stats.timer("threshold_sweep", len(g)):
+        sums = _threshold_sums(g, r, group, num_groups, sorted_thresholds, metric)
+
+    errors = np.full(sums.shape, np.nan)
+    np.divide(sums, counts, out=errors, where=counts > 0)
+    result = np.empty_like(errors)
+    result[:, order] = errors
+    return result
+
+
+def _threshold_sums(g: NDArray, r: NDArray, group: NDArray, num_groups: int, sorted_thresholds: NDArray,
+                    metric: str) -> NDArray:
+    # Summe der Fehler je Gruppe und sortiertem Grenzwert, Herleitung siehe threshold_errors(...)
+    t = sorted_thresholds[None, :]
+    if metric == METRIC_MSE:
+        rest = (100 - r) ** 2
+        by_gray = _BinnedSums(group, g, [g ** 2, g * r, r ** 2, rest], num_groups, sorted_thresholds)
+        sum_g2, sum_gr, sum_r2, rest_below = by_gray.below()
+        rest_total = by_gray.totals()[3]
+        sums = 1e4 * sum_g2 / t ** 2 - 200 * sum_gr / t + sum_r2 + (rest_total - rest_below)
+        # Rundungsfehler der Summen dürfen keinen negativen Fehler erzeugen
+        sums = np.maximum(sums, 0)
+    else:
+        rest = np.abs(100 - r)
+        by_gray = _BinnedSums(group, g, [g, r, rest], num_groups, sorted_thresholds)
+        sum_g, sum_r, rest_below = by_gray.below()
+        rest_total = by_gray.totals()[2]
+        # Ab t > crit ist 100 * g / t - r negativ. Für r > 100 ist es das für jedes t > g, für r <= 0 nie.
+        with np.errstate(divide="ignore"):
+            crit = np.where(r > 0, 100 * g / np.where(r > 0, r, 1), np.inf)
+        by_crit = _BinnedSums(group, np.maximum(crit, g), [g, r], num_groups, sorted_thresholds)
+        neg_g, neg_r = by_crit.below()
+        sums = (100 / t * sum_g - sum_r) - 2 * (100 / t * neg_g - neg_r) + (rest_total - rest_below)
+    return sums
+
+
+def hour_of_day(times: ArrayLike) -> NDArray:
+    times = np.asarray(times, dtype="datetime64[h]").reshape(-1)
+    return (times.astype("int64") % 24).astype("int64")
+
+
+def _nanmean_rows(errors: NDArray, axis: int) -> NDArray:
+    # wie np.nanmean(...), aber ohne RuntimeWarning für Zeilen, die nur aus NaN bestehen
+    valid = ~np.isnan(errors)
+    counts = valid.sum(axis=axis)
+    sums = np.where(valid, errors, 0).sum(axis=axis)
+    result = np.full(sums.shape, np.nan)
+    np.divide(sums, counts, out=result, where=counts > 0)
+    return result
+
+
+def best_thresholds(errors: NDArray, thresholds: ArrayLike = DEFAULT_THRESHOLDS) -> NDArray:
+    """
+    Grenzwert mit dem kleinsten Fehler je Zeile von errors, NaN für Zeilen ohne Fehlerwerte
+    """
+    thresholds = np.asarray(thresholds, dtype="float64").reshape(-1)
+    has_value = ~np.isnan(errors).all(axis=1)
+    best_idx = np.argmin(np.where(np.isnan(errors), np.inf, errors), axis=1)
+    return np.where(has_value, thresholds[best_idx], np.nan)
+
+
+def optimize_threshold(gray: ArrayLike,
+                       ref: ArrayLike,
+                       thresholds: ArrayLike = DEFAULT_THRESHOLDS,
+                       metric: str = METRIC_MSE,
+                       by: str = BY_ALL,
+                       times: ArrayLike | None = None) -> Tuple[NDArray, NDArray]:
+    """
+    Optimalen Graugrenzwert für die Wolkenerkennung bestimmen
+
+    gray und ref sind Matrizen der Form (Anzahl Zeitpunkte, Anzahl Stationen) mit den mittleren Grauwerten und den
+    Referenzbedeckungen in %. Zunächst wird für jede Station die Fehlerkurve über alle Grenzwerte berechnet:
+
+        - "all": Kurven über alle Stationen mitteln, ein Grenzwert
+        - "station": ein Grenzwert je Station
+        - "hour": Kurven je Station und Stunde (UTC) bilden, je Stunde über die Stationen mitteln; braucht times
+
+    Liefert die Fehlerkurven (Anzahl Gruppen, Anzahl Grenzwerte) und die besten Grenzwerte je Gruppe.
+    """
+    if by not in BY_MODES:
+        raise ValueError(f"Unknown grouping '{by}', expected one of: {BY_MODES}")
+    gray = np.asarray(gray, dtype="float64")
+    if gray.ndim != 2:
+        raise ValueError(f"The gray values must be a (times, stations) matrix, got the shape {gray.shape}")
+    num_times, num_stations = gray.shape
+    if by == BY_HOUR:
+        if times is None:
+            raise ValueError("The times are required to optimize the threshold per hour.")
+        hours = hour_of_day(times)
+        if len(hours) != num_times:
+            raise ValueError(f"Expected {num_times} times, got {len(hours)}")
+        groups = np.arange(num_stations)[None, :] * 24 + hours[:, None]
+        errors = threshold_errors(gray, ref, thresholds, metric, groups, num_stations * 24)
+        errors = _nanmean_rows(errors.reshape(num_stations, 24, -1), axis=0)
+    else:
+        errors = threshold_errors(gray, ref, thresholds, metric)
+        if by == BY_ALL:
+            errors = _nanmean_rows(errors, axis=0)[None, :]
+    return errors, best_thresholds(errors, thresholds)
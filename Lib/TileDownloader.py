@@ -0,0 +1,195 @@
+import os
+import json
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+from Lib.Instrumentation import stats
+
+
+# Server, von denen die Kacheln geladen werden können - der Reihe nach als Ausweichserver genutzt
+DEFAULT_MIRRORS: List[str] = ["https://services-a.meteored.com/",
+                              "https://services-b.meteored.com/",
+                              "https://services-c.meteored.com/"]
+TILE_URL_PATH: str = "img/tiles/viewer/satellite/6/{x}/{y}/{timestamp}_rgb.jpg"
+# Kacheln, die Deutschland abdecken
+GERMANY_TILES_X: List[int] = [33, 34]
+GERMANY_TILES_Y: List[int] = [20, 21, 22]
+
+STATUS_OK: str = "ok"
+STATUS_SKIPPED: str = "skipped"
+STATUS_FAILED: str = "failed"
+MANIFEST_FILENAME: str = "download_manifest.json"
+
+
+class TileDownloader:
+    """
+    Lädt Satelliten-Kacheln parallel mit begrenzter Anzahl gleichzeitiger Anfragen
+
+    Für jeden Server gibt es eine eigene Session mit Verbindungspool, Timeout und Wiederholungsstrategie. Schlägt
+    eine Kachel auf einem Server fehl, wird für genau diese Kachel der nächste Server versucht. Kacheln, die schon
+    auf der Festplatte liegen, werden übersprungen, sodass ein abgebrochener Lauf einfach neu gestartet werden kann.
+    Jede Kachel landet mit ihrem Ergebnis im Manifest (siehe write_manifest(...)), ebenso die Ergebnisse der
+    Bilderfusion, die über record_mosaic(...) gemeldet werden.
+    """
+    def __init__(self,
+                 output_dir: str,
+                 mirrors: List[str] | None = None,
+                 max_workers: int = 8,
+                 timeout: float | Tuple[float, float] = (5, 30),
+                 retries: int = 2,
+                 backoff: float = 0.5):
+        self.output_dir = os.path.abspath(output_dir)
+        self.mirrors = list(DEFAULT_MIRRORS if mirrors is None else mirrors)
+        if not self.mirrors:
+            raise ValueError("The TileDownloader needs at least one mirror.")
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.records: List[Dict] = []
+        self.mosaics: List[Dict] = []
+        self._records_lock = Lock()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET"], raise_on_status=False)
+        self._sessions: Dict[str, requests.Session] = {}
+        for mirror in self.mirrors:
+            host = urlsplit(mirror).netloc
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def tile_url(self, mirror: str, timestamp: int, x: int, y: int) -> str:
+        return mirror.rstrip("/") + "/" + TILE_URL_PATH.format(x=x, y=y, timestamp=timestamp)
+
+    def tile_path(self, timestamp: int, x: int, y: int) -> str:
+        # gleiche Ablage wie bisher: <output_dir>/<unix_ts>/<x>/<y>/<unix_ts>_rgb.jpg
+        return os.path.join(self.output_dir, f"{timestamp}", f"{x}", f"{y}", f"{timestamp}_rgb.jpg")
+
+    def fetch_tile(self, timestamp: int, x: int, y: int) -> Tuple[bytes | None, Dict]:
+        """
+        Kachel der Reihe nach von den Servern laden, liefert den Inhalt (oder None) und den Eintrag fürs Manifest
+        """
+        record = {"timestamp": timestamp, "x": x, "y": y, "status": STATUS_FAILED, "mirror": None, "errors": []}
+        with stats.timer("download_tile", 1):
+            for mirror in self.mirrors:
+                url = self.tile_url(mirror, timestamp, x, y)
+                try:
+                    response = self._sessions[urlsplit(mirror).netloc].get(url, timeout=self.timeout)
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    record["errors"].append(f"{url}: {e}")
+                    continue
+                record["status"] = STATUS_OK
+                record["mirror"] = mirror
+                stats.count("tiles_downloaded")
+                stats.count("bytes_downloaded", len(response.content))
+                return response.content, record
+        stats.count("tiles_failed")
+        return None, record
+
+    def download_tile(self, timestamp: int, x: int, y: int) -> Dict:
+        path = self.tile_path(timestamp, x, y)
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            record = {"timestamp": timestamp, "x": x, "y": y, "status": STATUS_SKIPPED, "mirror": None,
+                      "errors": [], "path": path}
+        else:
+            content, record = self.fetch_tile(timestamp, x, y)
+            if content is not None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # erst vollständig schreiben, dann umbenennen - halbe Kacheln gelten sonst als vorhanden
+                tmp_path = f"{path}.part"
+                with open(tmp_path, "wb") as img_file:
+                    img_file.write(content)
+                os.replace(tmp_path, path)
+                record["path"] = path
+        with self._records_lock:
+            self.records.append(record)
+        return record
+
+    def download(self,
+                 timestamps: Iterable[int],
+                 tiles_x: List[int] = GERMANY_TILES_X,
+                 tiles_y: List[int] = GERMANY_TILES_Y) -> List[Dict]:
+        """
+        Alle Kacheln aller Zeitpunkte mit max_workers gleichzeitigen Anfragen laden
+        """
+        jobs = [(timestamp, x, y) for timestamp in timestamps for y in tiles_y for x in tiles_x]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            records = list(tqdm(pool.map(lambda job: self.download_tile(*job), jobs), total=len(jobs),
+                                desc="Download der Teilbilder"))
+        return records
+
+    def iter_tiles(self,
+                   timestamps: Iterable[int],
+                   tiles_x: List[int] = GERMANY_TILES_X,
+                   tiles_y: List[int] = GERMANY_TILES_Y) -> Iterator[Tuple[int, int, int, bytes | None]]:
+        """
+        Kacheln im Speicher laden, ohne sie zu speichern, und als (timestamp, x, y, Inhalt oder None) liefern
+
+        Die Kacheln kommen in der Reihenfolge der Zeitpunkte. Es sind höchstens 4 * max_workers Anfragen
+        gleichzeitig unterwegs, damit fertige, aber noch nicht abgeholte Kacheln den Speicher nicht füllen.
+        """
+        def job(timestamp: int, x: int, y: int) -> Tuple[int, int, int, bytes | None]:
+            content, record = self.fetch_tile(timestamp, x, y)
+            with self._records_lock:
+                self.records.append(record)
+            return timestamp, x, y, content
+
+        jobs = ((timestamp, x, y) for timestamp in timestamps for y in tiles_y for x in tiles_x)
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for a_job in jobs:
+                in_flight.append(pool.submit(job, *a_job))
+                if len(in_flight) >= 4 * self.max_workers:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def record_mosaic(self, timestamp: int, status: str, path: str | None = None, error: str | None = None):
+        """
+        Ergebnis der Bilderfusion eines Zeitpunkts fürs Manifest festhalten
+        """
+        record = {"timestamp": timestamp, "status": status, "path": path, "errors": [] if error is None else [error]}
+        with self._records_lock:
+            self.mosaics.append(record)
+
+    def write_manifest(self, manifest_file: str | None = None) -> str:
+        """
+        Alle bisherigen Ergebnisse samt Fehlermeldungen als JSON speichern
+        """
+        if manifest_file is None:
+            manifest_file = os.path.join(self.output_dir, MANIFEST_FILENAME)
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_file)), exist_ok=True)
+        with self._records_lock:
+            records = sorted(self.records, key=lambda rec: (rec["timestamp"], rec["y"], rec["x"]))
+            mosaics = sorted(self.mosaics, key=lambda rec: rec["timestamp"])
+        summary = {status: sum(rec["status"] == status for rec in records)
+                   for status in (STATUS_OK, STATUS_SKIPPED, STATUS_FAILED)}
+        mosaic_summary = {status: sum(rec["status"] == status for rec in mosaics)
+                          for status in (STATUS_OK, STATUS_SKIPPED, STATUS_FAILED)}
+        with open(manifest_file, "w") as file:
+            json.dump({"created_utc": datetime.now(timezone.utc).isoformat(),
+                       "mirrors": self.mirrors,
+                       "summary": summary,
+                       "mosaic_summary": mosaic_summary,
+                       "tiles": records,
+                       "mosaics": mosaics}, file, indent=2)
+        return manifest_file
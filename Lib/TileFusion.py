@@ -0,0 +1,108 @@
+import os
+from io import BytesIO
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Tuple
+from tqdm import tqdm
+from Lib.TileDownloader import TileDownloader, GERMANY_TILES_X, GERMANY_TILES_Y
+from Lib.TileDownloader import STATUS_OK, STATUS_SKIPPED, STATUS_FAILED
+from Lib.Instrumentation import stats
+
+
+def mosaic_name(timestamp: int) -> str:
+    # Dateiname des fusionierten Bildes in UTC, z.B. 20240724_1200_UTC.jpg
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y%m%d_%H%M_UTC.jpg")
+
+
+def fuse_tiles(tiles: Dict[Tuple[int, int], bytes | Image.Image],
+               tiles_x: List[int] = GERMANY_TILES_X,
+               tiles_y: List[int] = GERMANY_TILES_Y) -> Image.Image:
+    """
+    Kacheln anhand ihrer Kachelkoordinaten (x, y) zu einem Bild zusammensetzen
+
+    Die Kachel (x, y) landet an der Position ((x - min(tiles_x)) * Breite, (y - min(tiles_y)) * Höhe), die
+    Anordnung hängt also nicht von der Reihenfolge ab, in der die Kacheln ankommen.
+    """
+    missing = [(x, y) for y in tiles_y for x in tiles_x if (x, y) not in tiles]
+    if missing:
+        raise ValueError(f"The tiles {missing} are missing for the mosaic.")
+    images = {}
+    for xy, tile in tiles.items():
+        try:
+            images[xy] = Image.open(BytesIO(tile)) if isinstance(tile, bytes) else tile
+        except OSError as e:
+            # z.B. eine Fehlerseite, die der Server mit Status 200 statt der Kachel liefert
+            raise ValueError(f"The tile {xy} is not a valid image: {e}") from None
+    # Nimm an, alle Bilder haben die gleiche Größe
+    width, height = images[(tiles_x[0], tiles_y[0])].size
+    min_x, min_y = min(tiles_x), min(tiles_y)
+    new_image = Image.new("RGB", ((max(tiles_x) - min_x + 1) * width, (max(tiles_y) - min_y + 1) * height))
+    for (x, y), image in images.items():
+        new_image.paste(image, ((x - min_x) * width, (y - min_y) * height))
+    return new_image
+
+
+def save_mosaic(tiles: Dict[Tuple[int, int], bytes | Image.Image],
+                img_path: str,
+                tiles_x: List[int] = GERMANY_TILES_X,
+                tiles_y: List[int] = GERMANY_TILES_Y) -> str:
+    with stats.timer("fuse_mosaic", 1):
+        new_image = fuse_tiles(tiles, tiles_x, tiles_y)
+        # erst vollständig schreiben, dann umbenennen - so gilt nur ein fertiges Bild als vorhanden
+        tmp_path = f"{img_path}.part"
+        new_image.save(tmp_path, format="JPEG")
+        os.replace(tmp_path, img_path)
+    stats.count("mosaics_written")
+    return img_path
+
+
+def download_and_fuse(downloader: TileDownloader,
+                      timestamps: Iterable[int],
+                      save_path: str,
+                      tiles_x: List[int] = GERMANY_TILES_X,
+                      tiles_y: List[int] = GERMANY_TILES_Y,
+                      fusion_workers: int = 4) -> List[str]:
+    """
+    Kacheln laden und direkt im Speicher zu Bildern in save_path fusionieren, ohne Zwischenablage der Kacheln
+
+    Zeitpunkte, deren fusioniertes Bild schon existiert, werden weder geladen noch fusioniert. Sobald alle Kacheln
+    eines Zeitpunkts da sind, wird das Bild in einem Thread-Pool fusioniert und gespeichert. Fehlt eine Kachel oder
+    lässt sich eine nicht lesen, wird nur dieser Zeitpunkt übersprungen. Das Ergebnis jedes Zeitpunkts steht über
+    downloader.record_mosaic(...) im Manifest. Liefert die gespeicherten Bilder.
+    """
+    os.makedirs(save_path, exist_ok=True)
+    todo = []
+    for timestamp in timestamps:
+        img_path = os.path.join(save_path, mosaic_name(timestamp))
+        if os.path.isfile(img_path):
+            downloader.record_mosaic(timestamp, STATUS_SKIPPED, img_path)
+        else:
+            todo.append(timestamp)
+    num_tiles = len(tiles_x) * len(tiles_y)
+    pending: Dict[int, Dict[Tuple[int, int], bytes | None]] = {}
+    futures = []
+    with ThreadPoolExecutor(max_workers=fusion_workers) as fusion_pool:
+        for timestamp, x, y, content in tqdm(downloader.iter_tiles(todo, tiles_x, tiles_y),
+                                             total=len(todo) * num_tiles, desc="Download und Bilderfusion"):
+            tiles = pending.setdefault(timestamp, {})
+            tiles[(x, y)] = content
+            if len(tiles) < num_tiles:
+                continue
+            del pending[timestamp]
+            missing = sorted(xy for xy, tile in tiles.items() if tile is None)
+            if missing:
+                downloader.record_mosaic(timestamp, STATUS_FAILED, error=f"The tiles {missing} could not be loaded.")
+                continue
+            img_path = os.path.join(save_path, mosaic_name(timestamp))
+            futures.append((timestamp, fusion_pool.submit(save_mosaic, tiles, img_path, tiles_x, tiles_y)))
+        img_files = []
+        for timestamp, future in futures:
+            try:
+                img_path = future.result()
+            except (OSError, ValueError) as e:
+                downloader.record_mosaic(timestamp, STATUS_FAILED, error=str(e))
+            else:
+                downloader.record_mosaic(timestamp, STATUS_OK, img_path)
+                img_files.append(img_path)
+        return img_files
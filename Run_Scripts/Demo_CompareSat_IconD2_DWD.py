@@ -1,50 +1,48 @@
 from Lib.SatImgReader import SatImgReader
-from datetime import datetime
+from datetime import datetime, timedelta
 from Lib import DWDStationReader as dwd
 from Lib import Grib2Reader as gr
 from Lib import IOConsts as ioc
-from pathlib import Path
+from Lib.EvaluationEngine import EvaluationEngine, SatelliteSource, DWDStationSource, GribSource, format_evaluation
+from Lib.EvaluationEngine import DWD_COL_DATE, GRIB_COL_DATE
+from Lib.ThresholdOptimizer import BY_ALL, BY_HOUR, BY_STATION
+from Lib.Instrumentation import dump_if_enabled
 import numpy as np
 
 
-# Testzeitraum und Testkoordinate bestimmen
-test_coord = (52.4537, 13.3017)
-dates = []
-imgs = list(Path(f"../combined_images/germany\\").glob(f"**/*.jpg"))
-if len(imgs) == 0:
-    raise ValueError("No images are exported in: '..\\combined_images\\germany\\'")
-for path in imgs:
-    # Dateiendung entfernen und den Dateinamen als Datetime-Objekt umwandeln
-    file = Path(path)
-    dt = datetime.strptime(file.stem, "%Y%m%d_%H%M_UTC")
-    dates.append(dt)
-
-# Laden der Sat.-Bilder
+# Laden der Sat.-Bilder, der Testzeitraum ergibt sich aus den vorhandenen Bildern
 sat_reader = SatImgReader(f"../combined_images/germany\\")
 sat_reader.initialize(own_threshold=197)  # 2024.07.22
-result_test2 = sat_reader.get_cloud_coverage(dates, test_coord)
-# print(result_test2)
+start_time = sat_reader.catalog.times[0].astype(datetime)
+end_time = sat_reader.catalog.times[-1].astype(datetime)
 
 # Laden der Grib2 Dateien
 g2r = gr.Grib2Datas()
 g2r.load_folder("..\\icon_d2")
-g2r_result = g2r.get_values(ioc.MODEL_ICON_D2, ioc.CLOUD_COVER, dates, test_coord)
-# print(g2r_result)
 
-# Laden der DWD-Stationsdateien
+# Laden der DWD-Stationsdateien, verglichen wird an allen Stationen mit geladenen Daten
 dwd_data = dwd.DWDStations()
 dwd_data.load_folder("..\\DWD_Stations")
-lat, lon = test_coord
-dwd_result = dwd_data.get_values(dates, lat, lon)
-# print(dwd_result)
+valid_entries = dwd_data.df[dwd_data.df[ioc.COL_DWD_LOADED].astype(bool)]
+lats = valid_entries[ioc.COL_LAT].to_numpy(dtype="float64")
+lons = valid_entries[ioc.COL_LON].to_numpy(dtype="float64")
 
-# Ergebnisse zusammenfügen
-result_test2["ICON_D2_TCDC"] = g2r_result[ioc.CLOUD_COVER]
-result_test2["DWD_CloudCoverage"] = (dwd_result["V_N"].astype(int) / 8) * 100
-# print(result_test2.to_string())
+# Satellit (eine Abfrage für alle Stationen und Zeitpunkte) und ICON-D2 mit den DWD-Stationen als Referenz
+# vergleichen, stündlich zur vollen Stunde wie die Stationsmeldungen. Die Werte werden über ihre Zeitstempel
+# zugeordnet, eine fehlende Stationsmeldung verschiebt also keine anderen Werte.
+engine = EvaluationEngine(lats, lons,
+                          reference=DWDStationSource(dwd_data, time_column=DWD_COL_DATE),
+                          sources=[SatelliteSource(sat_reader, name="Sat.Bilder"),
+                                   GribSource(g2r, ioc.MODEL_ICON_D2, ioc.CLOUD_COVER, name="ICON-D2",
+                                              time_column=GRIB_COL_DATE)])
+result = engine.evaluate_range(start_time, end_time, timedelta(hours=1))
 
-# Mittleren absoluten Fehler zwischen den Quellen mit DWD-Station als Referenz berechnen
-mae = np.mean(np.abs(result_test2["ICON_D2_TCDC"] - result_test2["DWD_CloudCoverage"]))
-print(f"Mean Absolute Error (MAE) [Cloud Coverage] ICON-D2 and DWD-Stations: {mae:.2f} %")
-mae = np.mean(np.abs(result_test2["Cloud_Coverage"] - result_test2["DWD_CloudCoverage"]))
-print(f"Mean Absolute Error (MAE) [Cloud Coverage] Sat.Bilder and DWD-Stations: {mae:.2f} %")
+print(f"Fehler [Cloud Coverage] gegenüber den DWD-Stationen ({len(lats)} Stationen, {start_time} - {end_time}):")
+print(format_evaluation(result, BY_ALL))
+print(format_evaluation(result, BY_HOUR))
+for name, by_stats in result.items():
+    station_mae = by_stats[BY_STATION]["mae"]
+    if not np.isnan(station_mae).all():
+        worst = int(np.nanargmax(station_mae))
+        print(f"{name}: größter MAE {station_mae[worst]:.2f} % an Station {(lats[worst], lons[worst])}")
+dump_if_enabled()
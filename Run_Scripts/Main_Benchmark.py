@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import numpy as np
+from datetime import datetime, timezone
+from Lib.SatImgReader import SatImgReader
+from Lib.ImgCatalog import CATALOG_FILENAME
+from Lib.TileFusion import download_and_fuse
+from Lib.ThresholdOptimizer import optimize_threshold, METRIC_MSE, METRIC_MAE, BY_ALL, BY_STATION, BY_HOUR
+from Lib.SyntheticData import generate_archive, synthetic_stations, synthetic_reference, SyntheticTileSource
+
+
+# Größe des synthetischen Archivs: 2 Tage im 5-Minuten-Takt, Mosaike 512 x 768 wie für Deutschland
+NUM_FRAMES = 576
+# Anfragegrößen (Anzahl Stationen, Anzahl Zeitpunkte) für get_cloud_coverage
+QUERY_SCALES = [(10, 12), (100, 12), (100, 288), (1000, 288)]
+# Größen (Anzahl Zeitpunkte, Anzahl Stationen) der Graumatrizen für die Grenzwertoptimierung
+SWEEP_SCALES = [(288, 100), (2880, 500), (8640, 1000)]
+NUM_FUSIONS = 48
+REPEAT = 3
+
+
+def run_benchmark(results, name, func, items, repeat=REPEAT, setup=None, **params):
+    """
+    func repeat-mal ausführen (setup jeweils vorher, nicht gemessen) und Laufzeiten samt Durchsatz festhalten
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    result = {"name": name,
+              "params": params,
+              "items": items,
+              "seconds": seconds,
+              "min_s": min(seconds),
+              "median_s": float(np.median(seconds)),
+              "items_per_s": items / min(seconds) if min(seconds) > 0 else None}
+    results.append(result)
+    print(f"{name:<40} {json.dumps(params):<50} min {result['min_s'] * 1000:10.2f} ms  "
+          f"{result['items_per_s'] or 0:14.0f} items/s")
+    return result
+
+
+# Prozesse des Pools importieren dieses Skript erneut, daher nur im Hauptprozess ausführen
+if __name__ == "__main__":
+    # Ergebnisdatei optional als erstes Argument, sonst im Ordner benchmark_results
+    out_file = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        "../benchmark_results", datetime.now(timezone.utc).strftime("benchmark_%Y%m%d_%H%M%S.json"))
+    work_dir = tempfile.mkdtemp(prefix="sat_benchmark_")
+    results = []
+    try:
+        img_dir = os.path.join(work_dir, "combined_images")
+        times = generate_archive(img_dir, NUM_FRAMES)
+
+        # ---- Aufbau des SatImgReader: ohne und mit gespeichertem Katalog ---- #
+        # mit Tagesordnern und flach wie bei TileFusion, dort liegt der Katalog im selben Ordner wie die Bilder
+        flat_dir = os.path.join(work_dir, "combined_images_flat")
+        generate_archive(flat_dir, NUM_FRAMES, frames_per_dir=None)
+        for layout, layout_dir in [("day_dirs", img_dir), ("flat", flat_dir)]:
+            layout_catalog = os.path.join(layout_dir, CATALOG_FILENAME)
+            run_benchmark(results, "reader_init_cold", lambda: SatImgReader(layout_dir), NUM_FRAMES,
+                          setup=lambda: os.path.exists(layout_catalog) and os.remove(layout_catalog),
+                          frames=NUM_FRAMES, layout=layout)
+            run_benchmark(results, "reader_init_warm", lambda: SatImgReader(layout_dir), NUM_FRAMES,
+                          frames=NUM_FRAMES, layout=layout)
+
+        # ---- get_cloud_coverage: ohne Cache (jedes Bild dekodieren) und mit gefülltem Cache ---- #
+        reader = SatImgReader(img_dir)
+        reader.initialize()
+        for num_stations, num_times in QUERY_SCALES:
+            coords = [tuple(coord) for coord in synthetic_stations(num_stations)]
+            query_times = times[:num_times].astype("datetime64[s]").tolist()
+            datetimes = [a_time for a_time in query_times for _ in coords]
+            query_coords = coords * num_times
+            params = {"stations": num_stations, "timestamps": num_times}
+            run_benchmark(results, "get_cloud_coverage_cold",
+                          lambda: reader.get_cloud_coverage(datetimes, query_coords), len(datetimes),
+                          setup=reader.frame_cache.clear, **params)
+            run_benchmark(results, "get_cloud_coverage_warm",
+                          lambda: reader.get_cloud_coverage(datetimes, query_coords), len(datetimes), **params)
+
+        # ---- Bilderfusion aus Kacheln im Speicher ---- #
+        timestamps = [int(a_time.timestamp()) for a_time in
+                      times[:NUM_FUSIONS].astype("datetime64[s]").astype(datetime).tolist()]
+        tile_source = SyntheticTileSource(timestamps)
+        fusion_dir = os.path.join(work_dir, "fusion")
+        run_benchmark(results, "tile_fusion", lambda: download_and_fuse(tile_source, timestamps, fusion_dir),
+                      NUM_FUSIONS, setup=lambda: shutil.rmtree(fusion_dir, ignore_errors=True),
+                      mosaics=NUM_FUSIONS)
+
+        # ---- Grenzwertoptimierung ---- #
+        rng = np.random.default_rng(0)
+        for num_times, num_stations in SWEEP_SCALES:
+            gray = rng.uniform(0, 255, (num_times, num_stations))
+            ref = synthetic_reference(gray)
+            sweep_times = np.datetime64("2024-07-24T00:00") + np.arange(num_times) * np.timedelta64(5, "m")
+            for metric, by in [(METRIC_MSE, BY_ALL), (METRIC_MAE, BY_ALL), (METRIC_MSE, BY_STATION),
+                               (METRIC_MSE, BY_HOUR)]:
+                run_benchmark(results, "threshold_sweep",
+                              lambda: optimize_threshold(gray, ref, metric=metric, by=by, times=sweep_times),
+                              gray.size, timestamps=num_times, stations=num_stations, metric=metric, by=by)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"created_utc": datetime.now(timezone.utc).isoformat(),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "platform": platform.platform(),
+              "cpu_count": os.cpu_count(),
+              "config": {"num_frames": NUM_FRAMES, "repeat": REPEAT},
+              "results": results}
+    os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+    with open(out_file, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Ergebnisse gespeichert in: {out_file}")
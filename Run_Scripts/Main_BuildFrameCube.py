@@ -0,0 +1,11 @@
+from Lib.ImgCatalog import load_catalog
+from Lib.FrameCube import build_frame_cube
+
+
+# Alle fusionierten Bilder als Graustufen in den FrameCube übernehmen, bereits enthaltene Bilder werden übersprungen
+img_dir = "../combined_images/germany"
+cube_dir = "../frame_cube/germany"
+
+catalog = load_catalog(img_dir)
+cube = build_frame_cube(catalog, cube_dir)
+print(f"FrameCube in '{cube_dir}' enthält {len(cube)} Bilder der Größe {cube.img_width} x {cube.img_height}.")
@@ -0,0 +1,39 @@
+import os
+import sys
+from Lib.SatImgReader import SatImgReader
+from Lib.FrameCube import FrameCube
+from Lib.CoverageService import CoverageService, make_server, DEFAULT_REFRESH_SECONDS
+from Lib.Instrumentation import dump_if_enabled
+
+
+# Dauerhaft laufender Dienst für Bedeckungsgrade: Katalog, Projektion und dekodierte Bilder bleiben zwischen den
+# Anfragen im Speicher, neu fusionierte Bilder werden alle DEFAULT_REFRESH_SECONDS Sekunden übernommen.
+# Aufruf: python Main_CoverageService.py [Pfad eines Unix-Sockets], sonst HTTP auf host:port
+#
+# Beispiel:
+#   curl -X POST http://127.0.0.1:8765/coverage \
+#        -d '{"times": ["2024-07-24T12:00"], "coords": [[52.45, 13.30], [48.14, 11.58]], "query": "grid"}'
+img_dir = "../combined_images/germany"
+cube_dir = "../frame_cube/germany"
+host, port = "127.0.0.1", 8765
+socket_path = sys.argv[1] if len(sys.argv) > 1 else None
+
+# 1 GiB für dekodierte Bilder, ein Graustufenbild von Deutschland hat knapp 400 KiB
+reader = SatImgReader(img_dir, cache_bytes=1024 ** 3, cube_dir=cube_dir if FrameCube.is_cube(cube_dir) else None)
+reader.initialize()
+
+service = CoverageService(reader, DEFAULT_REFRESH_SECONDS)
+server = make_server(service, host, port, socket_path)
+service.start()
+print(f"{len(reader.catalog)} Bilder geladen, Dienst läuft auf "
+      f"{socket_path if socket_path is not None else f'http://{host}:{port}'} (Beenden mit Strg+C)")
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+    service.stop()
+    if socket_path is not None and os.path.exists(socket_path):
+        os.remove(socket_path)
+    dump_if_enabled()
@@ -1,137 +1,146 @@
-from datetime import datetime
-from pathlib import Path
+import os
 from Lib import DWDStationReader as dwd
 from Lib.IOConsts import COL_LAT, COL_LON, COL_DWD_LOADED
+from Lib.MercatorProjection import MercatorProjection
+from Lib.FrameCube import FrameCube
+from Lib.ImgCatalog import load_catalog
+from Lib.StationStore import StationStore
+from Lib.ParallelExtract import parallel_frame_means
+from Lib.EvaluationEngine import DWDStationSource, DWD_COL_DATE, align_values
+from Lib.ThresholdOptimizer import optimize_threshold, DEFAULT_THRESHOLDS, METRIC_MSE, METRIC_MAE, BY_ALL, BY_HOUR
+from Lib.Instrumentation import stats, dump_if_enabled
 from PIL import Image
-from tqdm import tqdm
 import numpy as np
 
 
-def latlon_to_pixel(lat, lon, width, height):
-    # Mercator Projektion
-    # Berechne die x-Koordinate (Longitude)
-    pix_x = (lon - min_lon) / (max_lon - min_lon) * width
-
-    # Berechne die y-Koordinate (Latitude) unter Verwendung der Mercator-Projektion
-    lat_rad = np.radians(lat)
-    min_lat_rad = np.radians(min_lat)
-    max_lat_rad = np.radians(max_lat)
-    pix_y = (np.log(np.tan(np.pi / 4 + lat_rad / 2)) - np.log(np.tan(np.pi / 4 + min_lat_rad / 2))) / \
-            (np.log(np.tan(np.pi / 4 + max_lat_rad / 2)) - np.log(np.tan(np.pi / 4 + min_lat_rad / 2))) * height
-
-    # Pixelkoordinaten umdrehen, da y in Bildern von oben nach unten geht
-    return int(pix_x), int(height - pix_y)
-
-
-def calculate_column_means(arr):
-    # Leeres Array für die Mittelwerte
-    column_means = []
-    # Schleife über jede Spalte
-    for arr_col in range(arr.shape[1]):
-        # Extrahiere die Spalte
-        column_data = arr[:, arr_col]
-        # Berechne den Mittelwert, wenn die Spalte keine nur NaN-Werte enthält
-        if np.isnan(column_data).all():
-            column_means.append(np.NaN)
-        else:
-            column_mean = np.nanmean(column_data)
-            column_means.append(column_mean)
-    return column_means
-
-
-# Definieren des Zeitraums der Optimiert werden soll, als Quelle hier dienen die Sat-Bilder
-dates = []
-imgs = list(Path(f"../combined_images/germany\\").glob(f"**/*.jpg"))
-if len(imgs) == 0:
-    raise ValueError("Es exierieren keine Bilder in: '..\\combined_images\\germany\\'")
-
-# Jedes Bild steht für ein Datum und Uhrzeit, d.h. Anzahl dates = Anzahl Bilder
-for path in imgs:
-    # Dateiendung entfernen und den Dateinamen als Datetime-Objekt umwandeln
-    file = Path(path)
-    dt = datetime.strptime(file.stem, "%Y%m%d_%H%M_UTC")
-    dates.append(dt)
-
-# Referenz laden und Koordinaten holen
-dwd_data = dwd.DWDStations()
-dwd_data.load_folder("..\\DWD_Stations")
-# lese nur die geladenen Einträge aus
-valid_entries = dwd_data.df[dwd_data.df[COL_DWD_LOADED].astype(bool)]
-coords = list(zip(valid_entries[COL_LAT], valid_entries[COL_LON]))
-
-# Referenzen als numpy Array befüllen
-ref_dwd_values = np.full((len(dates), len(coords)), np.NaN)
-for col, (a_lat, a_lon) in tqdm(enumerate(coords), total=len(coords), desc="Referenzwerte der DWD-Stationen auslesen"):
-    res = dwd_data.get_values(dates, a_lat, a_lon)
-    if not res.empty:
-        # sicherstellen, dass die Einfügeindizes nicht über die Grenzen gehen
-        num_values_to_fill = min(len(dates), len(res))
-        ref_dwd_values[:num_values_to_fill, col] = res["V_N"][:num_values_to_fill]
-ref_dwd_values = (ref_dwd_values / 8) * 100
-
-# Hole Abmaße der Bilder
-tmp_img = Image.open(imgs[0])
-img_height, img_width = tmp_img.size
-
-# Grenzen des Bildes setzen - Ablesen anhand eines Bildes und OpenStreetMap
-min_lon, max_lon = 5.632, 16.887
-min_lat, max_lat = 45.129, 55.772
-
-# Radius der Erde
-earth_radius = 6371
-
-# Elemente von coords in Pixel umwandeln
-pxls = []
-for a_lat, a_lon in tqdm(coords, total=len(coords), desc="Koordinaten in Pixel umwandeln"):
-    # y_tmp, x_tmp = _gps_to_pixel(a_lat, a_lon, trans_mat)
-    y_tmp, x_tmp = latlon_to_pixel(a_lat, a_lon, img_width, img_height)
-    pxls.append((y_tmp, x_tmp))
-
-# Für jedes Pixel die Werte mit Radius = 4 Pixel holen und den Mittelwert davon bilden
-radius = 4
-mean_gray_pxl_date = np.zeros((len(imgs), len(pxls)))
-for row, path in tqdm(enumerate(imgs), total=len(imgs), desc="Pixel aus den Bildern auslesen"):
-    tmp_img = Image.open(path)
-    tmp_grayscale_img = tmp_img.convert("L")
-    tmp_img_arr = np.array(tmp_grayscale_img)
-    for col, (y, x) in enumerate(pxls):
-        region = tmp_img_arr[y - radius:y + radius, x - radius:x + radius]
-        if not region.size == 0:
-            mean_gray_pxl_date[row, col] = np.mean(region)
-        else:
-            mean_gray_pxl_date[row, col] = np.NaN
-
-if mean_gray_pxl_date.shape != (len(dates), len(pxls)):
-    raise ValueError(f"Fehler beim Erzeugen vom mean_gray_pxl_date-Array.\n"
-                     f"Erwartetes Shape: {(len(dates), len(pxls))}\n"
-                     f"Bekommenes Shape: {mean_gray_pxl_date.shape}")
-
-# Definieren der zu prüfenden Graugrenzwerte zur Wolkenerkennung
-gray_thresholds = range(1, 256)
-
-# Berechnete Bereiche der Grauwerte mit dem jeweiligen Grenzwert normieren
-# all_mean_thresholds = np.zeros((len(gray_thresholds), len(pxls)))
-all_mean_thresholds = np.full((len(gray_thresholds), len(pxls)), np.NaN)
-norm_gray_pxl = np.zeros(mean_gray_pxl_date.shape)
-for row, threshold in tqdm(enumerate(gray_thresholds), total=len(gray_thresholds), desc="Grauwertoptimierung"):
-    if threshold != 0:
-        norm_gray_pxl = (mean_gray_pxl_date / threshold) * 100
-    norm_gray_pxl[norm_gray_pxl > 100] = 100
-    # Differenz zwischen Referenz und SatBilder berechnen
-    diff_arr = norm_gray_pxl - ref_dwd_values
-    pot_arr = diff_arr ** 2
-    # Enferne alle Zeilen, die nur aus NaN bestehen
-    non_nan_rows = ~np.isnan(pot_arr).all(axis=1)
-    filtered_arr = pot_arr[non_nan_rows]
-    all_mean_thresholds[row, :] = calculate_column_means(filtered_arr)
-    # nicht np.nanmean(...) verwenden, da es Spalten mit Nan geben kann und es dann eine RuntimeWarning erzeugt
-    # all_mean_thresholds[row, :] = np.nanmean(filtered_arr, axis=0)
-
-if all_mean_thresholds.shape != (len(gray_thresholds), len(pxls)):
-    raise ValueError(f"Fehler beim Erzeugen vom all_mean_thresholds-Array.\n"
-                     f"Erwartetes Shape: {(len(gray_thresholds), len(pxls))}\n")
-
-# Mittelwert von allen ermittelten Grauwerte der Koordinaten bilden, zeilenweise
-final_result = np.nanmean(all_mean_thresholds, axis=1)
-
-print(f"Gemittelte Idealwert für alle Koordinaten: {gray_thresholds[np.argmin(final_result)]}")
+def folder_key(directory):
+    # Kennung des Stands eines Ordners aus Anzahl, Größe und Änderungszeit aller Dateien darin
+    num_files, total_size, last_mtime = 0, 0, 0
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                else:
+                    stat = entry.stat()
+                    num_files, total_size = num_files + 1, total_size + stat.st_size
+                    last_mtime = max(last_mtime, stat.st_mtime_ns)
+    return f"{num_files}:{total_size}:{last_mtime}"
+
+
+def extract_gray_means(files, times, mtimes, pxl_x, pxl_y, radius, workers, cube_dir):
+    mean_gray = np.zeros((len(files), len(pxl_x)))
+    # Bilder, die schon im FrameCube stehen (siehe Main_BuildFrameCube.py), ohne Dekodieren auslesen
+    in_cube = np.zeros(len(files), dtype=bool)
+    if FrameCube.is_cube(cube_dir):
+        cube = FrameCube(cube_dir)
+        # neu geschriebene Bilder nicht aus dem Würfel lesen, sondern dekodieren
+        frame_idx = cube.lookup(times, mtimes=mtimes)
+        in_cube = frame_idx >= 0
+        mean_gray[in_cube] = cube.window_series(pxl_y, pxl_x, radius, frame_idx[in_cube])
+    # alle übrigen Bilder auf alle Prozessorkerne verteilt dekodieren und auslesen, am Bildrand beschnitten
+    missing_rows = np.flatnonzero(~in_cube)
+    if len(missing_rows) > 0:
+        mean_gray[missing_rows] = parallel_frame_means([str(files[row]) for row in missing_rows],
+                                                       pxl_x, pxl_y, radius, workers)[:, :, 0]
+    return mean_gray
+
+
+# Prozesse des Pools importieren dieses Skript erneut, daher nur im Hauptprozess ausführen
+if __name__ == "__main__":
+    # Definieren des Zeitraums der Optimiert werden soll, als Quelle hier dienen die Sat-Bilder
+    img_dir = "../combined_images/germany"
+    catalog = load_catalog(img_dir)
+    if len(catalog) == 0:
+        raise ValueError(f"Es exierieren keine Bilder in: '{img_dir}'")
+    # Jedes Bild steht für ein Datum und Uhrzeit, d.h. Anzahl dates = Anzahl Bilder
+    dates = catalog.times
+
+    # Referenz laden und Koordinaten holen
+    dwd_dir = "..\\DWD_Stations"
+    dwd_data = dwd.DWDStations()
+    dwd_data.load_folder(dwd_dir)
+    # lese nur die geladenen Einträge aus
+    valid_entries = dwd_data.df[dwd_data.df[COL_DWD_LOADED].astype(bool)]
+    coords = list(zip(valid_entries[COL_LAT], valid_entries[COL_LON]))
+    coords_arr = np.array(coords, dtype="float64").reshape(-1, 2)
+
+    # Hole Abmaße der Bilder
+    tmp_img = Image.open(catalog.files[0])
+    img_width, img_height = tmp_img.size
+
+    # Grenzen des Bildes setzen - Ablesen anhand eines Bildes und OpenStreetMap
+    min_lon, max_lon = 5.632, 16.887
+    min_lat, max_lat = 45.129, 55.772
+
+    # Radius der Erde
+    earth_radius = 6371
+
+    # Elemente von coords in Pixel umwandeln
+    projection = MercatorProjection(min_lat, max_lat, min_lon, max_lon, img_width, img_height)
+    pxl_x, pxl_y = projection.latlon_to_pixel(coords_arr[:, 0], coords_arr[:, 1])
+    pxls = list(zip(pxl_y, pxl_x))
+
+    # Für jedes Pixel die Werte mit Radius = 4 Pixel holen und den Mittelwert davon bilden
+    radius = 4
+    # Anzahl der Prozesse zum Auslesen der Bilder
+    workers = os.cpu_count()
+
+    # Grauwerte und Referenzen aus dem letzten Lauf laden, nur neue oder geänderte Bilder auslesen und nur fehlende
+    # Referenzwerte abfragen - alle, wenn sich die DWD-Daten geändert haben
+    store_file = "../station_store/germany_optimizer.npz"
+    store = StationStore.load(store_file, coords_arr[:, 0], coords_arr[:, 1], radius, projection)
+    with stats.timer("update_gray"):
+        changed = store.update_gray(catalog.times, catalog.mtimes,
+                                    lambda rows: extract_gray_means(catalog.files[rows], catalog.times[rows],
+                                                                    catalog.mtimes[rows], pxl_x, pxl_y, radius,
+                                                                    workers, "../frame_cube/germany"))
+
+    # Meldungen über ihren Zeitstempel (MESS_DATUM) statt der Reihe nach zuordnen, eine fehlende Meldung verschiebt
+    # so keine anderen Werte. Zeitpunkte ohne Meldung bleiben NaN.
+    dwd_source = DWDStationSource(dwd_data, time_column=DWD_COL_DATE)
+
+    def fetch_ref(times, station):
+        query_times, inverse = np.unique(times, return_inverse=True)
+        ref_times, _, ref_values = dwd_source.fetch(query_times, coords_arr[station:station + 1, 0],
+                                                    coords_arr[station:station + 1, 1])
+        aligned = align_values(query_times, 1, ref_times, np.zeros(len(ref_values), dtype="int64"), ref_values)
+        return aligned[inverse.reshape(-1), 0]
+
+    with stats.timer("update_ref"):
+        changed |= store.update_ref(fetch_ref, folder_key(dwd_dir))
+    if changed:
+        store.save(store_file)
+    mean_gray_pxl_date = store.gray_values()
+    ref_dwd_values = store.ref.astype("float64")
+
+    if mean_gray_pxl_date.shape != (len(dates), len(pxls)):
+        raise ValueError(f"Fehler beim Erzeugen vom mean_gray_pxl_date-Array.\n"
+                         f"Erwartetes Shape: {(len(dates), len(pxls))}\n"
+                         f"Bekommenes Shape: {mean_gray_pxl_date.shape}")
+
+    # Definieren der zu prüfenden Graugrenzwerte zur Wolkenerkennung, Zwischenwerte wie 0.5er-Schritte sind möglich
+    gray_thresholds = DEFAULT_THRESHOLDS
+
+    # Fehlerkurven aller Grenzwerte in einem Schritt: erst je Station den MSE zwischen normierten Grauwerten und
+    # Referenz bilden, dann über alle Koordinaten mitteln
+    all_mean_thresholds, best_threshold = optimize_threshold(mean_gray_pxl_date, ref_dwd_values, gray_thresholds,
+                                                             METRIC_MSE, BY_ALL)
+
+    if all_mean_thresholds.shape != (1, len(gray_thresholds)):
+        raise ValueError(f"Fehler beim Erzeugen vom all_mean_thresholds-Array.\n"
+                         f"Erwartetes Shape: {(1, len(gray_thresholds))}\n")
+
+    print(f"Gemittelte Idealwert für alle Koordinaten: {best_threshold[0]:g}")
+
+    # Idealwerte je Stunde (UTC) und mit mittlerem absoluten Fehler zum Vergleich
+    _, best_hourly = optimize_threshold(mean_gray_pxl_date, ref_dwd_values, gray_thresholds, METRIC_MSE, BY_HOUR,
+                                        dates)
+    for hour, threshold in enumerate(best_hourly):
+        if not np.isnan(threshold):
+            print(f"Idealwert für {hour:02d} UTC: {threshold:g}")
+    _, best_mae = optimize_threshold(mean_gray_pxl_date, ref_dwd_values, gray_thresholds, METRIC_MAE, BY_ALL)
+    print(f"Gemittelte Idealwert für alle Koordinaten (MAE): {best_mae[0]:g}")
+    # Laufzeiten und Zähler, nur mit SAT_INSTRUMENTATION=1 bzw. SAT_TRACE=<Datei>
+    dump_if_enabled()
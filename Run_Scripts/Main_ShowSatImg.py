@@ -1,30 +1,13 @@
-from Lib.SatImgReader import *
-from PIL import Image
-from matplotlib import pyplot as plt
+import os
+from datetime import datetime, timedelta
+from Lib.SatImgReader import SatImgReader, DEFAULT_RADIUS
+from Lib.BatchRenderer import render_reader_range, render_reader_animation
+from Lib.ParallelExtract import default_workers
+from Lib.Instrumentation import dump_if_enabled
 import numpy as np
 
 
-# Funktion zur Umwandlung von Koordinaten in Pixel
-def latlon_to_pixel(img, lon, lat):
-    # ---> Funktion aus SatImReader kopiert <---
-
-    width, height = img.size
-    # Mercator Projektion
-    # Berechne die x-Koordinate (Longitude)
-    x = (lon - MIN_LON_GER) / (MAX_LON_GER - MIN_LON_GER) * width
-
-    # Berechne die y-Koordinate (Latitude) unter Verwendung der Mercator-Projektion
-    lat_rad = np.radians(lat)
-    min_lat_rad = np.radians(MIN_LAT_GER)
-    max_lat_rad = np.radians(MAX_LAT_GER)
-    y = (np.log(np.tan(np.pi / 4 + lat_rad / 2)) - np.log(np.tan(np.pi / 4 + min_lat_rad / 2))) / \
-        (np.log(np.tan(np.pi / 4 + max_lat_rad / 2)) - np.log(np.tan(np.pi / 4 + min_lat_rad / 2))) * height
-
-    # Pixelkoordinaten umdrehen, da y in Bildern von oben nach unten geht
-    return int(x), int(height - y)
-
-
-# Darstellen aller DWD-Stationen auf einem Satellitenbild
+# Darstellen aller DWD-Stationen auf den Satellitenbildern
 # dwd_data = dwd.DWDStations()
 # dwd_data.load_folder("..\\DWD_Stations")
 # show_poses = list(zip(dwd_data.df[COL_LAT], dwd_data.df[COL_LON]))
@@ -33,24 +16,27 @@ show_poses = [(52.519683856228305, 13.40824400801289),
               (47.568693047361656, 10.699923350545903),
               (51.05061896926067, 5.905757455655236),
               (50.60682981164014, 10.689812285349753)]
-
-# Beispiel Bild laden
-img_name = "20240724_1200_UTC.jpg"
-tmp_img = Image.open(f"..\\combined_images\\germany\\{img_name}")
-image_np = np.array(tmp_img)
-
-# Koordinaten in Pixel umwandeln
-img_x, img_y = [], []
-for _lat, _lon in show_poses:
-    tmp_x, tmp_y = latlon_to_pixel(tmp_img, _lon, _lat)
-    img_x.append(tmp_x)
-    img_y.append(tmp_y)
-
-# Umgewandelte Pixelkoordinaten plotten
-plt.imshow(image_np)
-plt.scatter(img_x, img_y,
-            color="red",
-            marker="x")
-plt.title(f"GPS coordinates on the image of: {img_name}")
-plt.axis("off")  # Achsen ausschalten
-plt.show()
+show_poses_arr = np.array(show_poses, dtype="float64")
+
+# Prozesse des Pools importieren dieses Skript erneut, daher nur im Hauptprozess ausführen
+if __name__ == "__main__":
+    sat_reader = SatImgReader("../combined_images/germany")
+    sat_reader.initialize()
+
+    # Beispiel Bild mit allen Stationen anzeigen
+    sat_reader.show_image(datetime(2024, 7, 24, 12, 0), show_poses_arr[:, 0], show_poses_arr[:, 1])
+
+    # Kontrollbilder eines ganzen Tages ohne Fenster schreiben, die Marker sind nach dem Bedeckungsgrad eingefärbt
+    day = datetime(2024, 7, 24)
+    out_dir = os.path.join("../rendered_frames", day.strftime("%Y%m%d"))
+    files = render_reader_range(sat_reader, day, day + timedelta(days=1) - timedelta(minutes=1),
+                                show_poses_arr[:, 0], show_poses_arr[:, 1], out_dir, workers=default_workers(),
+                                coverage_radius=DEFAULT_RADIUS)
+    print(f"{len(files)} Bilder gespeichert in {out_dir}")
+
+    # und als halb so große Animation
+    animation_file = render_reader_animation(sat_reader, day, day + timedelta(days=1) - timedelta(minutes=1),
+                                             show_poses_arr[:, 0], show_poses_arr[:, 1], f"{out_dir}.gif", fps=12,
+                                             coverage_radius=DEFAULT_RADIUS, scale=0.5)
+    print(f"Animation gespeichert in {animation_file}")
+    dump_if_enabled()
@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+from datetime import datetime
+from Lib.EvaluationEngine import EvaluationEngine, ArraySource, CoverageSource
+from Lib.EvaluationEngine import STAT_COUNT, STAT_MAE, STAT_BIAS, STAT_RMSE
+from Lib.ThresholdOptimizer import BY_ALL, BY_STATION, BY_HOUR
+
+
+# Referenz an zwei Stationen zu zwei vollen Stunden
+TIMES = np.array(["2024-07-24T00:00", "2024-07-24T01:00"], dtype="datetime64[m]")
+LATS = [52.5, 48.1]
+LONS = [13.4, 11.6]
+REFERENCE = [[0.0, 50.0],
+             [100.0, 50.0]]
+
+
+def fixture_source() -> ArraySource:
+    # Abweichungen zur Referenz: Station 0 +10 und -30, Station 1 -10, um 01:00 fehlt Station 1
+    return ArraySource("fixture",
+                       times=["2024-07-24T00:00", "2024-07-24T00:00", "2024-07-24T01:00", "2024-07-24T01:00",
+                              # kein Zeitpunkt des Rasters bzw. keine gültige Station - wird verworfen
+                              "2024-07-24T00:30", "2024-07-24T01:00"],
+                       stations=[0, 1, 0, 0, 0, 5],
+                       # zwei Werte für Station 0 um 01:00 werden zu 70 gemittelt
+                       values=[10.0, 40.0, 60.0, 80.0, 99.0, 99.0])
+
+
+class EvaluationEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = EvaluationEngine(LATS, LONS,
+                                       reference=ArraySource.from_matrix("reference", TIMES, REFERENCE),
+                                       sources=[fixture_source()])
+
+    def test_collect_aligns_by_timestamp(self):
+        aligned = self.engine.collect(TIMES)
+        np.testing.assert_array_equal(aligned["reference"], REFERENCE)
+        np.testing.assert_array_equal(aligned["fixture"], [[10.0, 40.0], [70.0, np.nan]])
+
+    def test_error_stats(self):
+        result = self.engine.evaluate(TIMES)["fixture"]
+        overall = result[BY_ALL]
+        np.testing.assert_array_equal(overall[STAT_COUNT], [3])
+        np.testing.assert_allclose(overall[STAT_MAE], [50 / 3])
+        np.testing.assert_allclose(overall[STAT_BIAS], [-10.0])
+        np.testing.assert_allclose(overall[STAT_RMSE], [np.sqrt(1100 / 3)])
+
+        by_station = result[BY_STATION]
+        np.testing.assert_array_equal(by_station[STAT_COUNT], [2, 1])
+        np.testing.assert_allclose(by_station[STAT_MAE], [20.0, 10.0])
+        np.testing.assert_allclose(by_station[STAT_BIAS], [-10.0, -10.0])
+        np.testing.assert_allclose(by_station[STAT_RMSE], [np.sqrt(500), 10.0])
+
+        by_hour = result[BY_HOUR]
+        self.assertEqual(len(by_hour[STAT_COUNT]), 24)
+        np.testing.assert_array_equal(by_hour[STAT_COUNT][:2], [2, 1])
+        np.testing.assert_allclose(by_hour[STAT_MAE][:2], [10.0, 30.0])
+        np.testing.assert_allclose(by_hour[STAT_BIAS][:2], [0.0, -30.0])
+        np.testing.assert_allclose(by_hour[STAT_RMSE][:2], [10.0, 30.0])
+        self.assertTrue(np.isnan(by_hour[STAT_MAE][2:]).all())
+
+    def test_evaluate_range_starts_at_full_hour(self):
+        # das Raster beginnt zur vollen Stunde, nicht zur Minute des ersten Bildes
+        result = self.engine.evaluate_range(datetime(2024, 7, 24, 0, 5), datetime(2024, 7, 24, 1, 5))
+        np.testing.assert_array_equal(result["fixture"][BY_ALL][STAT_COUNT], [3])
+        np.testing.assert_allclose(result["fixture"][BY_ALL][STAT_MAE], [50 / 3])
+
+    def test_source_must_implement_fetch(self):
+        class IncompleteSource(CoverageSource):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteSource("incomplete")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from Lib.FrameCube import FrameCube, build_frame_cube
+from Lib.FrameDecoder import decode_frame
+from Lib.ImgCatalog import load_catalog
+from Lib.SyntheticData import generate_archive
+
+
+class FrameCubeTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="frame_cube_")
+        self.img_dir = os.path.join(self.root, "img")
+        self.cube_dir = os.path.join(self.root, "cube")
+        generate_archive(self.img_dir, 4)
+        self.catalog = load_catalog(self.img_dir, persist=False)
+        self.cube = build_frame_cube(self.catalog, self.cube_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def replace_image(self, src_idx: int, dst_idx: int) -> str:
+        # Bild dst_idx durch den Inhalt von src_idx ersetzen, wie beim erneuten Herunterladen
+        dst = str(self.catalog.files[dst_idx])
+        shutil.copyfile(str(self.catalog.files[src_idx]), f"{dst}.tmp")
+        os.replace(f"{dst}.tmp", dst)
+        os.utime(dst, ns=(self.catalog.mtimes[dst_idx] + 10 ** 9,) * 2)
+        return dst
+
+    def test_lookup_ignores_replaced_files(self):
+        np.testing.assert_array_equal(self.cube.lookup(self.catalog.times, mtimes=self.catalog.mtimes), [0, 1, 2, 3])
+        self.replace_image(3, 1)
+        catalog = load_catalog(self.img_dir, persist=False)
+        np.testing.assert_array_equal(self.cube.lookup(catalog.times, mtimes=catalog.mtimes), [0, -1, 2, 3])
+        # ohne Änderungszeiten wird nur nach dem Zeitstempel gesucht
+        np.testing.assert_array_equal(self.cube.lookup(catalog.times), [0, 1, 2, 3])
+
+    def test_build_replaces_stale_frames(self):
+        dst = self.replace_image(3, 1)
+        catalog = load_catalog(self.img_dir, persist=False)
+        cube = build_frame_cube(catalog, self.cube_dir)
+        self.assertEqual(len(cube), 4)
+        np.testing.assert_array_equal(cube.lookup(catalog.times, mtimes=catalog.mtimes), [0, 1, 2, 3])
+        np.testing.assert_array_equal(FrameCube(self.cube_dir).frame(1), decode_frame(dst))
+
+
+if __name__ == "__main__":
+    unittest.main()
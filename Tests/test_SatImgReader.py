@@ -0,0 +1,36 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from Lib.SatImgReader import SatImgReader, COL_DATE, RESULT_ARRAYS
+from Lib.SyntheticData import generate_archive, synthetic_stations
+
+
+class IterCloudCoverageTest(unittest.TestCase):
+    def setUp(self):
+        self.img_dir = tempfile.mkdtemp(prefix="sat_img_reader_")
+        times = generate_archive(self.img_dir, 4)
+        stations = synthetic_stations(5)
+        # jede Station zu jedem Bild, zeitlich sortiert
+        self.times = np.repeat(times, len(stations))
+        self.coords = np.tile(stations, (len(times), 1))
+
+    def tearDown(self):
+        shutil.rmtree(self.img_dir, ignore_errors=True)
+
+    def test_stream_bypasses_frame_cache(self):
+        reader = SatImgReader(self.img_dir, persist_catalog=False)
+        reader.initialize()
+        parts = list(reader.iter_cloud_coverage(self.times, self.coords, radius=[2, 6], batch_size=7,
+                                                result=RESULT_ARRAYS))
+        self.assertEqual([len(part[COL_DATE]) for part in parts], [7, 7, 6])
+        # die gestreamten Bilder verdrängen nichts aus dem Cache
+        self.assertEqual(len(reader.frame_cache), 0)
+
+        expected = reader.get_cloud_coverage(self.times, self.coords, radius=[2, 6], result=RESULT_ARRAYS)
+        for name, values in expected.items():
+            np.testing.assert_array_equal(np.concatenate([part[name] for part in parts]), values)
+
+
+if __name__ == "__main__":
+    unittest.main()
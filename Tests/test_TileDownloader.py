@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Set, Tuple
+from Lib.TileDownloader import TileDownloader, STATUS_OK, STATUS_SKIPPED, STATUS_FAILED
+
+
+TIMESTAMP = 1721822400
+TILES_X = [33, 34]
+TILES_Y = [20, 21]
+
+
+def tile_content(x: int, y: int) -> bytes:
+    return f"tile {x}/{y}".encode()
+
+
+class MirrorServer:
+    """
+    Lokaler Ersatz für einen Kachelserver, der nur die Kacheln in tiles liefert und alle Anfragen mitschreibt
+    """
+    def __init__(self, tiles: Set[Tuple[int, int]]):
+        self.tiles = tiles
+        self.requests: List[Tuple[int, int]] = []
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                # Pfad: /img/tiles/viewer/satellite/6/<x>/<y>/<timestamp>_rgb.jpg
+                x, y = (int(part) for part in self.path.split("/")[-3:-1])
+                mirror.requests.append((x, y))
+                if (x, y) in mirror.tiles:
+                    body, code = tile_content(x, y), 200
+                else:
+                    body, code = b"not found", 404
+                self.send_response(code)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TileDownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix="tile_downloader_")
+        # Server A fehlt die Kachel (34, 20), Server B hat sie, (34, 21) gibt es auf keinem Server
+        self.mirror_a = MirrorServer({(33, 20), (33, 21)})
+        self.mirror_b = MirrorServer({(33, 20), (33, 21), (34, 20)})
+        self.downloader = TileDownloader(self.output_dir, [self.mirror_a.url, self.mirror_b.url], max_workers=4,
+                                         timeout=5, retries=0)
+
+    def tearDown(self):
+        self.downloader.close()
+        self.mirror_a.close()
+        self.mirror_b.close()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def records_by_tile(self, records: List[Dict]) -> Dict[Tuple[int, int], Dict]:
+        return {(record["x"], record["y"]): record for record in records}
+
+    def test_failover_per_tile(self):
+        records = self.records_by_tile(self.downloader.download([TIMESTAMP], TILES_X, TILES_Y))
+        self.assertEqual(records[(33, 20)]["status"], STATUS_OK)
+        self.assertEqual(records[(33, 20)]["mirror"], self.mirror_a.url)
+        # nur die fehlende Kachel wird bei Server B angefragt
+        self.assertEqual(records[(34, 20)]["status"], STATUS_OK)
+        self.assertEqual(records[(34, 20)]["mirror"], self.mirror_b.url)
+        self.assertEqual(len(records[(34, 20)]["errors"]), 1)
+        self.assertEqual(sorted(self.mirror_b.requests), [(34, 20), (34, 21)])
+        with open(self.downloader.tile_path(TIMESTAMP, 34, 20), "rb") as tile_file:
+            self.assertEqual(tile_file.read(), tile_content(34, 20))
+        # auf keinem Server vorhanden: Fehler beider Server im Eintrag, keine Datei
+        self.assertEqual(records[(34, 21)]["status"], STATUS_FAILED)
+        self.assertEqual(len(records[(34, 21)]["errors"]), 2)
+        self.assertFalse(os.path.exists(self.downloader.tile_path(TIMESTAMP, 34, 21)))
+
+    def test_skip_tiles_on_disk(self):
+        path = self.downloader.tile_path(TIMESTAMP, 33, 21)
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as tile_file:
+            tile_file.write(b"already downloaded")
+        records = self.records_by_tile(self.downloader.download([TIMESTAMP], TILES_X, TILES_Y))
+        self.assertEqual(records[(33, 21)]["status"], STATUS_SKIPPED)
+        self.assertNotIn((33, 21), self.mirror_a.requests + self.mirror_b.requests)
+        with open(path, "rb") as tile_file:
+            self.assertEqual(tile_file.read(), b"already downloaded")
+
+    def test_manifest_summary(self):
+        self.downloader.download([TIMESTAMP], TILES_X, TILES_Y)
+        # zweiter Lauf: vorhandene Kacheln werden übersprungen, die fehlende erneut versucht
+        self.downloader.download([TIMESTAMP], TILES_X, TILES_Y)
+        with open(self.downloader.write_manifest()) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertEqual(manifest["summary"], {STATUS_OK: 3, STATUS_SKIPPED: 3, STATUS_FAILED: 2})
+        self.assertEqual(manifest["mirrors"], [self.mirror_a.url, self.mirror_b.url])
+        self.assertEqual(len(manifest["tiles"]), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()